@@ -0,0 +1,94 @@
+#
+import numpy as np
+
+
+class CameraPath:
+    """
+    camera の軌跡。全フレーム分を numpy の配列で持つ。
+    position, focal_point, view_up: (N, 3), parallel_scale: (N,)
+    """
+
+    def __init__(self, position, focal_point, view_up, parallel_scale):
+        self.position = np.asarray(position, dtype=float)
+        self.focal_point = np.asarray(focal_point, dtype=float)
+        self.view_up = np.asarray(view_up, dtype=float)
+        self.parallel_scale = np.asarray(parallel_scale, dtype=float)
+
+    def __len__(self):
+        return len(self.position)
+
+    def apply(self, camera, i):
+        camera.SetFocalPoint(self.focal_point[i])
+        camera.SetPosition(self.position[i])
+        camera.SetViewUp(self.view_up[i])
+        camera.SetParallelScale(self.parallel_scale[i])
+        camera.OrthogonalizeViewUp()
+
+
+def camera_info(camera):
+    return {
+        "position": list(camera.GetPosition()),
+        "focalPoint": list(camera.GetFocalPoint()),
+        "viewUp": list(camera.GetViewUp()),
+        "parallelScale": camera.GetParallelScale(),
+    }
+
+
+def _normalize(v):
+    n = np.linalg.norm(v, axis=-1, keepdims=True)
+    return v / np.where(n > 0, n, 1.0)
+
+
+def _rotate(v, axis, angles):
+    """v (3,) を axis 周りに angles (N,) だけ回す (Rodrigues)"""
+    k = axis / np.linalg.norm(axis)
+    c = np.cos(angles)[:, None]
+    s = np.sin(angles)[:, None]
+    return v * c + np.cross(k, v) * s + k * np.dot(k, v) * (1 - c)
+
+
+def turntable(camera_info, frames, turns=1.0, axis=None):
+    """view-up (または axis) 周りに 1 周する軌跡"""
+    fc = np.asarray(camera_info["focalPoint"], dtype=float)
+    pos = np.asarray(camera_info["position"], dtype=float)
+    up = np.asarray(camera_info["viewUp"], dtype=float)
+    axis = up if axis is None else np.asarray(axis, dtype=float)
+
+    angles = np.linspace(0, 2 * np.pi * turns, frames, endpoint=False)
+    return CameraPath(
+        fc + _rotate(pos - fc, axis, angles),
+        np.broadcast_to(fc, (frames, 3)),
+        _rotate(up, axis, angles),
+        np.full(frames, camera_info["parallelScale"]),
+    )
+
+
+def keyframes(infos, frames_per_key):
+    """
+    keyframe の間を補間する軌跡。
+    位置は焦点からの向きと距離を別々に補間するので、弧を描いて動く。
+    """
+    if len(infos) < 2:
+        raise ValueError('two or more keyframes are required')
+
+    fc = np.array([k["focalPoint"] for k in infos], dtype=float)
+    offset = np.array([k["position"] for k in infos], dtype=float) - fc
+    dist = np.linalg.norm(offset, axis=1)
+    direction = _normalize(offset)
+    up = np.array([k["viewUp"] for k in infos], dtype=float)
+    scale = np.array([k["parallelScale"] for k in infos], dtype=float)
+
+    # 各区間 0..1 を smoothstep で加減速
+    t = np.linspace(0, 1, frames_per_key, endpoint=False)
+    t = t * t * (3 - 2 * t)
+    seg = np.repeat(np.arange(len(infos) - 1), frames_per_key)
+    t = np.tile(t, len(infos) - 1)[:, None]
+    seg = np.append(seg, len(infos) - 2)
+    t = np.append(t, [[1.0]], axis=0)
+
+    def lerp(a):
+        return a[seg] + (a[seg + 1] - a[seg]) * (t if a.ndim > 1 else t[:, 0])
+
+    focal = lerp(fc)
+    position = focal + _normalize(lerp(direction)) * lerp(dist)[:, None]
+    return CameraPath(position, focal, _normalize(lerp(up)), lerp(scale))
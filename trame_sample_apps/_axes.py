@@ -0,0 +1,58 @@
+#
+from vtkmodules.vtkCommonTransforms import vtkTransform
+from vtkmodules.vtkFiltersCore import vtkAppendPolyData
+from vtkmodules.vtkFiltersGeneral import vtkTransformPolyDataFilter
+from vtkmodules.vtkFiltersSources import vtkOutlineSource
+from vtkmodules.vtkRenderingFreeType import vtkVectorText
+
+AXES_MODES = [
+    {"text": "Cube axes", "value": "cube"},
+    {"text": "Outline", "value": "outline"},
+    {"text": "Orientation", "value": "widget"},
+]
+
+
+def _label(text, position, height):
+    src = vtkVectorText()
+    src.SetText(text)
+    t = vtkTransform()
+    t.Translate(position)
+    t.Scale(height, height, height)
+    f = vtkTransformPolyDataFilter()
+    f.SetInputConnection(src.GetOutputPort())
+    f.SetTransform(t)
+    return f
+
+
+def outline_polydata(bounds, label_scale=0.04):
+    """
+    bounds の箱と、各軸の min/max の数字だけの polydata。
+    camera によらないので bounds ごとに 1 回作れば済む。
+    """
+    x0, x1, y0, y1, z0, z1 = bounds
+    diag = ((x1 - x0)**2 + (y1 - y0)**2 + (z1 - z0)**2) ** 0.5
+    h = diag * label_scale
+    gap = h * 0.5
+
+    outline = vtkOutlineSource()
+    outline.SetBounds(bounds)
+
+    append = vtkAppendPolyData()
+    append.AddInputConnection(outline.GetOutputPort())
+    labels = [
+        ('%.3g' % x0, (x0, y0 - gap - h, z0)),
+        ('%.3g' % x1, (x1, y0 - gap - h, z0)),
+        ('X', ((x0 + x1) / 2, y0 - gap - h, z0)),
+        ('%.3g' % y0, (x1 + gap, y0, z0)),
+        ('%.3g' % y1, (x1 + gap, y1, z0)),
+        ('Y', (x1 + gap, (y0 + y1) / 2, z0)),
+        ('%.3g' % z0, (x0 - gap, y1 + gap, z0)),
+        ('%.3g' % z1, (x0 - gap, y1 + gap, z1)),
+        ('Z', (x0 - gap, y1 + gap, (z0 + z1) / 2)),
+    ]
+    # Update() が終わるまで filter の参照を持っておく
+    filters = [_label(text, position, h) for text, position in labels]
+    for f in filters:
+        append.AddInputConnection(f.GetOutputPort())
+    append.Update()
+    return append.GetOutput()
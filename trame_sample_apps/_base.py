@@ -1,8 +1,11 @@
 #
+import math
+import time
+import asyncio
 from inspect import signature  # noqa
 from pprint import pprint  # noqa
 
-from trame.app import get_server
+from trame.app import get_server, asynchronous
 from trame.widgets import vuetify, vtk as vtk_widgets
 from trame.ui.vuetify import SinglePageLayout  # noqa
 from trame.ui.vuetify import SinglePageWithDrawerLayout  # noqa
@@ -19,6 +22,9 @@ from vtkmodules.vtkCommonTransforms import (
 from vtkmodules.vtkInteractionStyle import vtkInteractorStyleSwitch  # noqa
 from vtkmodules.vtkCommonColor import vtkNamedColors
 
+from ._animation import camera_info, turntable, keyframes
+from ._sync import SceneSync
+
 
 VTK_VIEW_SCALE_INFO = {
     "default": 1.0,
@@ -32,6 +38,12 @@ VTK_VIEW_SETTINGS = {
     "interactive_quality": 100,
 }
 
+ANIMATION_INFO = {
+    "fps": 30,
+    "turntable_seconds": 12.0,
+    "keyframe_seconds": 3.0,
+}
+
 VTK_VIEW_EVENTS = [
     "StartAnimation",
     "Animation",
@@ -154,13 +166,75 @@ def initCamera(renderer, prop0):
     # printCameraInfo(camera)
 
 
+def boundsInFrustum(camera, aspect, bounds):
+    planes = [0.0]*24
+    camera.GetFrustumPlanes(aspect, planes)
+    for i in range(6):
+        a, b, c, d = planes[i*4:i*4+4]
+        # 法線方向に一番遠い頂点でも外側なら、視野外
+        x = bounds[1] if a > 0 else bounds[0]
+        y = bounds[3] if b > 0 else bounds[2]
+        z = bounds[5] if c > 0 else bounds[4]
+        if a*x + b*y + c*z + d < 0:
+            return False
+    return True
+
+
+def boundsPixelSize(camera, height, bounds):
+    dx = bounds[1] - bounds[0]
+    dy = bounds[3] - bounds[2]
+    dz = bounds[5] - bounds[4]
+    diag = (dx*dx + dy*dy + dz*dz) ** 0.5
+    if camera.GetParallelProjection():
+        extent = 2.0 * camera.GetParallelScale()
+    else:
+        p = camera.GetPosition()
+        cx = (bounds[0] + bounds[1]) / 2 - p[0]
+        cy = (bounds[2] + bounds[3]) / 2 - p[1]
+        cz = (bounds[4] + bounds[5]) / 2 - p[2]
+        dist = (cx*cx + cy*cy + cz*cz) ** 0.5
+        extent = 2.0 * dist * math.tan(math.radians(camera.GetViewAngle()) / 2)
+    if extent <= 0:
+        return float('inf')
+    return diag / extent * height
+
+
 class myView(vtk_widgets.VtkLocalView):
+    _orientation_axis = False
+    _sync = None
+
     def __init__(self, view, **kwargs):
+        kwargs.setdefault("on_ready", self.on_client_ready)
         super().__init__(view, **kwargs)
+        # client ごとに、持っていない object と配列だけ送る
+        self._sync = SceneSync(self._helper, view, f"scene_{self.ref_name}")
+        self._sync.attach(self.server)
 
-    def update(self, *args, **kwargs):
+    @property
+    def sync(self):
+        return self._sync
+
+    def on_client_ready(self, *args, **kwargs):
+        # client 側で view ができた (作り直された) ので全部送る
+        if self._sync is not None:
+            self._sync.reset()
+        self.update()
+
+    def set_orientation_axis(self, value):
+        # orientation axes は client 側で描く
+        self._orientation_axis = bool(value)
+
+    def update(self, widgets=None, **kwargs):
         # print('In update')
-        super().update(*args, **kwargs)
+        kwargs.setdefault('orientation_axis', int(self._orientation_axis))
+        if self._sync is None:
+            super().update(widgets, **kwargs)
+            return
+        if widgets is None:
+            widgets = self.get_widgets()
+        nbytes = self._sync.update(widgets, kwargs['orientation_axis'])
+        if self.server.protocol:
+            self.server.state.sync_bytes = nbytes
 
     def reset_camera(self, *args, **kwargs):
         # print('In reset_camera')
@@ -190,6 +264,17 @@ class BaseViewer:
 
         self._vtk_rw = None
         self._ui = None
+        self._view = None
+        self._animation_task = None
+        self._viewpoints = []
+        self._view_size = None  # client の view の大きさ (pixel)
+
+        state = self._server.state
+        state.setdefault("animation_playing", None)
+        state.setdefault("animation_fps", 0.0)
+        state.setdefault("animation_dropped", 0)
+        state.setdefault("viewpoint_count", 0)
+        state.setdefault("sync_bytes", 0)  # 前回の view 更新で送った byte 数
 
         self._vtk_rw = self._vtk_setup()
         self._ui = self._setup_ui()
@@ -224,6 +309,21 @@ class BaseViewer:
         for x in self.generate_actors(renderer):
             renderer.AddActor(x)
 
+        self.reset_camera_prop0(renderer)
+
+        renderWindow = vtkRenderWindow()
+        renderWindow.AddRenderer(renderer)
+        renderWindow.OffScreenRenderingOn()
+
+        renderWindowInteractor = vtkRenderWindowInteractor()
+        renderWindowInteractor.SetRenderWindow(renderWindow)
+        renderWindowInteractor.GetInteractorStyle() \
+                              .SetCurrentStyleToTrackballCamera()
+
+        renderWindow.Render()
+        return renderWindow
+
+    def reset_camera_prop0(self, renderer):
         # ResetCamera()はしておく
         renderer.ResetCamera()
         camera = renderer.GetActiveCamera()
@@ -243,18 +343,6 @@ class BaseViewer:
         initCamera(renderer, self._camera_prop0)
         # printCameraInfo(renderer.GetActiveCamera())
 
-        renderWindow = vtkRenderWindow()
-        renderWindow.AddRenderer(renderer)
-        renderWindow.OffScreenRenderingOn()
-
-        renderWindowInteractor = vtkRenderWindowInteractor()
-        renderWindowInteractor.SetRenderWindow(renderWindow)
-        renderWindowInteractor.GetInteractorStyle() \
-                              .SetCurrentStyleToTrackballCamera()
-
-        renderWindow.Render()
-        return renderWindow
-
     @change("scale")
     def update_scale(self, scale=-1, **kwargs):
         # print('update_scale> ', scale)
@@ -262,9 +350,22 @@ class BaseViewer:
         for r in self._vtk_rw.GetRenderers():
             r.GetActiveCamera().SetParallelScale(ps)
         self.push_camera()
+        self.update_level_of_detail()
         self.server.controller.update_views()
         # printCameraInfo(renderer.GetActiveCamera())
 
+    def update_level_of_detail(self):
+        """
+        camera が決まったところ (scale の変更と操作の終わり) で呼ばれる。
+        表示の細かさを変えるならここで。
+        """
+        pass
+
+    def view_height(self, default=None):
+        if self._view_size is not None:
+            return self._view_size[1]
+        return default if default is not None else self._vtk_rw.GetSize()[1]
+
     def update_reset_scale(self):
         self.server.state.scale = VTK_VIEW_SCALE_INFO['default']
         # print('update_reset_scale> ', self.server.state.scale)
@@ -296,10 +397,18 @@ class BaseViewer:
         # print('on_right', pickData)
         pass
 
-    def on_end_animation(self, camera_info):
+    def on_start_animation(self, *a, **k):
+        pass
+
+    def on_end_animation(self, camera_info, view_size=None):
         # print('on_end_animation')
         # pprint(camera_info)
         # print()
+        if view_size and len(view_size) == 2:
+            self._view_size = tuple(view_size)
+
+        # 手で動かしたら animation は止める
+        self.stop_animation()
 
         do_push = False
         s = camera_info.get("parallelScale")
@@ -325,11 +434,119 @@ class BaseViewer:
 
         if do_push or True:
             self.push_camera()
+            self.update_level_of_detail()
             self.server.controller.update_views()
         self.server.state.scale = scale
 
+    # camera path
+
+    def _apply_camera_path(self, path, i):
+        for r in self._vtk_rw.GetRenderers():
+            path.apply(r.GetActiveCamera(), i)
+
+    async def _animate(self, name, path, fps, loop):
+        """
+        経過時間から表示するフレームを決めるので、描画や通信が遅れたら
+        その分のフレームは飛ばす。
+        """
+        state = self.server.state
+        period = 1.0 / fps
+        t0 = start = time.perf_counter()  # t0 は loop ごとに進める
+        shown = dropped = 0
+        last = -1
+        try:
+            while True:
+                i = int((time.perf_counter() - t0) * fps)
+                if i >= len(path):
+                    if not loop:
+                        i = len(path) - 1
+                    else:
+                        i %= len(path)
+                        t0 += len(path) * period
+                        last -= len(path)
+                advanced = i > last
+                if advanced:
+                    dropped += max(0, i - last - 1)
+                    last = i
+                    self._apply_camera_path(path, i)
+                    self.push_camera()
+                    shown += 1
+                    # client 側からの処理待ちがあれば終わるまで待つ
+                    if self.server.context.network_monitor is not None:
+                        await self.server.network_completion
+
+                now = time.perf_counter()
+                elapsed = now - t0
+                # 新しいフレームを出したときだけ (同じ値を何度も送らない)
+                if advanced and (shown % fps == 0 or
+                                 (not loop and i == len(path) - 1)):
+                    with state:
+                        state.animation_fps = round(
+                            shown / max(now - start, period), 1)
+                        state.animation_dropped = dropped
+                if not loop and i == len(path) - 1:
+                    break
+                await asyncio.sleep(max(0.0, (last + 1) * period - elapsed))
+        finally:
+            if self._animation_task is asyncio.current_task():
+                self._animation_task = None
+                with state:
+                    state.animation_playing = None
+                    state.scale = round(
+                        self._camera_prop0['parallelScale'] /
+                        self.renderer.GetActiveCamera().GetParallelScale(), 1)
+        if self.debug:
+            elapsed = max(time.perf_counter() - start, period)
+            print(f'{name}: {shown} frames, {dropped} dropped,',
+                  f'{shown / elapsed:.1f} fps')
+
+    def play_camera_path(self, name, path, fps=None, loop=False):
+        self.stop_animation()
+        fps = fps or ANIMATION_INFO['fps']
+        self.server.state.animation_playing = name
+        self._animation_task = asynchronous.create_task(
+            self._animate(name, path, fps, loop))
+
+    def stop_animation(self):
+        task, self._animation_task = self._animation_task, None
+        if task is not None:
+            task.cancel()
+            self.server.state.animation_playing = None
+
+    def play_turntable(self):
+        if self.server.state.animation_playing == "turntable":
+            self.stop_animation()
+            return
+        fps = ANIMATION_INFO['fps']
+        frames = int(ANIMATION_INFO['turntable_seconds'] * fps)
+        info = camera_info(self.renderer.GetActiveCamera())
+        self.play_camera_path("turntable", turntable(info, frames), fps,
+                              loop=True)
+
+    def save_viewpoint(self):
+        self._viewpoints.append(camera_info(self.renderer.GetActiveCamera()))
+        self.server.state.viewpoint_count = len(self._viewpoints)
+
+    def clear_viewpoints(self):
+        self._viewpoints = []
+        self.server.state.viewpoint_count = 0
+
+    def play_viewpoints(self):
+        if self.server.state.animation_playing == "viewpoints":
+            self.stop_animation()
+            return
+        # 今の camera から、保存した viewpoint を順にたどる
+        infos = [camera_info(self.renderer.GetActiveCamera())]
+        infos += self._viewpoints
+        if len(infos) < 2:
+            return
+        fps = ANIMATION_INFO['fps']
+        frames = int(ANIMATION_INFO['keyframe_seconds'] * fps)
+        self.play_camera_path("viewpoints", keyframes(infos, frames), fps)
+
     def setup_ui_in_layout_toolbar(self, toolbar):
         vuetify.VSpacer()
+        self.setup_ui_animation()
         vuetify.VSlider(
             label='Scale:',
             v_model=("scale", VTK_VIEW_SCALE_INFO['default']),
@@ -344,6 +561,40 @@ class BaseViewer:
         with vuetify.VBtn(icon=True, click=self.update_reset_scale):
             vuetify.VIcon("mdi-undo-variant")
 
+    def setup_ui_animation(self):
+        if self.debug:
+            vuetify.VChip(
+                "{{ (sync_bytes / 1024).toFixed(1) }} KiB",
+                small=True,
+                outlined=True,
+                classes="mx-1",
+            )
+        vuetify.VChip(
+            "{{ animation_fps }} fps",
+            v_show="animation_playing",
+            small=True,
+            outlined=True,
+            classes="mx-1",
+        )
+        with vuetify.VBtn(icon=True, click=self.play_turntable):
+            vuetify.VIcon(
+                "{{ animation_playing == 'turntable' ? "
+                "'mdi-stop' : 'mdi-rotate-3d-variant' }}")
+        with vuetify.VBtn(icon=True, click=self.save_viewpoint):
+            vuetify.VIcon("mdi-camera-plus-outline")
+        with vuetify.VBtn(icon=True, click=self.play_viewpoints,
+                          disabled=("viewpoint_count == 0",)):
+            with vuetify.VBadge(content=("viewpoint_count",),
+                                value=("viewpoint_count",),
+                                overlap=True):
+                vuetify.VIcon(
+                    "{{ animation_playing == 'viewpoints' ? "
+                    "'mdi-stop' : 'mdi-play' }}")
+        with vuetify.VBtn(icon=True, click=self.clear_viewpoints,
+                          disabled=("viewpoint_count == 0",)):
+            vuetify.VIcon("mdi-camera-off-outline")
+        vuetify.VDivider(vertical=True, classes="mx-2")
+
     def setup_ui_in_layout_drawer(self, drawer):
         drawer.width = 0
 
@@ -370,6 +621,7 @@ class BaseViewer:
                         interactor_events=(
                             "events",
                             ["RightButtonRelease",
+                             "StartAnimation",
                              "EndAnimation",
                              ],
                         ),
@@ -377,9 +629,12 @@ class BaseViewer:
                             self.on_right_button_release,
                             "[utils.vtk.event($event)]",
                         ),
+                        StartAnimation=self.on_start_animation,
                         EndAnimation=(
                             self.on_end_animation,
-                            "[$event.pokedRenderer.getActiveCamera().get()]",
+                            "[$event.pokedRenderer.getActiveCamera().get(),"
+                            " $event.pokedRenderer.getRenderWindow()"
+                            ".getViews()[0].getSize()]",
                         ),
                         # interactor_events=("event_types", VTK_VIEW_EVENTS),
                         # **event_listeners(VTK_VIEW_EVENTS),
@@ -388,5 +643,6 @@ class BaseViewer:
                     self.server.controller.update_views.add(view.update)
                     self.server.controller.reset_camera.add(view.reset_camera)
                     self._push_camera = view.push_camera
+                    self._view = view
 
             return layout
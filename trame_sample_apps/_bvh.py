@@ -0,0 +1,232 @@
+#
+import math
+
+import numpy as np
+
+BVH_INFO = {
+    "leaf_size": 4,  # 葉に入れる block の数
+    "min_pixels": 2.0,  # これより小さく見える block は描かない
+}
+
+
+def frustum_planes(camera, aspect):
+    """
+    視野の左右上下の (4, 4) の平面 (ax + by + cz + d < 0 が外側)。
+    near/far は client 側で data にあわせて決めるので使わない。
+    """
+    planes = [0.0] * 24
+    camera.GetFrustumPlanes(aspect, planes)
+    return np.array(planes).reshape(6, 4)[:4]
+
+
+def box_distance(lo, hi, point):
+    """点から箱までの距離 (中なら 0)"""
+    d = np.maximum(np.maximum(lo - point, point - hi), 0.0)
+    return np.linalg.norm(d, axis=1)
+
+
+def pixel_sizes(lo, hi, camera, height, distance=None):
+    """
+    boundsPixelSize() を箱の配列にしたもの。
+    distance を渡すと、その距離で見たときの大きさ。
+    """
+    diag = np.linalg.norm(hi - lo, axis=1)
+    if camera.GetParallelProjection():
+        extent = np.full(len(lo), 2.0 * camera.GetParallelScale())
+    else:
+        if distance is None:
+            distance = np.linalg.norm(
+                (lo + hi) / 2 - np.array(camera.GetPosition()), axis=1)
+        extent = 2.0 * distance * \
+            math.tan(math.radians(camera.GetViewAngle()) / 2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(extent > 0, diag / extent * height, np.inf)
+
+
+class BVH:
+    """
+    block の bounds の上に 1 回だけ作る bounding volume hierarchy。
+
+    node は配列で持つ。block は葉に leaf_size 個までで、どの node も
+    order[start:start + count] がその下の block になる。
+    set_active() で外した block (非表示) は検索結果に出ず、その下が全部
+    外れた node はたどらない。update() は block の箱を変えて、その上の
+    node の箱だけ直す (読み直したとき)。
+    """
+
+    def __init__(self, bounds, leaf_size=None):
+        b = np.asarray(bounds, dtype=float).reshape(-1, 6)
+        self._lo = b[:, 0::2].copy()
+        self._hi = b[:, 1::2].copy()
+        # 空の block (bounds が未初期化) は箱なし
+        empty = (self._lo > self._hi).any(axis=1)
+        self._lo[empty], self._hi[empty] = np.inf, -np.inf
+        self.active = ~empty
+        leaf_size = leaf_size or BVH_INFO["leaf_size"]
+
+        center = (b[:, 0::2] + b[:, 1::2]) / 2
+        center[empty] = 0.0
+        order, nodes = [], []  # nodes: [left, right, start, count, parent]
+
+        def build(ids, parent):
+            n = len(nodes)
+            nodes.append([-1, -1, len(order), len(ids), parent])
+            if len(ids) <= leaf_size:
+                order.extend(ids.tolist())
+                return n
+            # 中心が一番ばらついている軸で半分に分ける
+            c = center[ids]
+            axis = int(np.argmax(c.max(axis=0) - c.min(axis=0)))
+            ids = ids[np.argsort(c[:, axis], kind="stable")]
+            half = len(ids) // 2
+            nodes[n][0] = build(ids[:half], n)
+            nodes[n][1] = build(ids[half:], n)
+            return n
+
+        build(np.arange(len(b)), -1)
+        nodes = np.array(nodes, dtype=np.int64).reshape(-1, 5)
+        self._left, self._right, self._start, self._count, self._parent = \
+            nodes.T.copy()
+        self._order = np.array(order, dtype=np.int64)
+        self._leaf = np.empty(len(b), dtype=np.int64)
+        for n in np.flatnonzero(self._left < 0):
+            self._leaf[self._blocks(n)] = n
+
+        self._node_lo = np.empty((len(nodes), 3))
+        self._node_hi = np.empty((len(nodes), 3))
+        self._nactive = np.zeros(len(nodes), dtype=np.int64)
+        # 子は親より後に作られているので、後ろから箱をまとめる
+        for n in range(len(nodes) - 1, -1, -1):
+            self._refit(n)
+
+    def __len__(self):
+        return len(self._lo)
+
+    def _blocks(self, n):
+        return self._order[self._start[n]:self._start[n] + self._count[n]]
+
+    def _refit(self, n):
+        if self._left[n] < 0:
+            ids = self._blocks(n)
+            self._node_lo[n] = self._lo[ids].min(axis=0)
+            self._node_hi[n] = self._hi[ids].max(axis=0)
+            self._nactive[n] = self.active[ids].sum()
+        else:
+            c = [self._left[n], self._right[n]]
+            self._node_lo[n] = self._node_lo[c].min(axis=0)
+            self._node_hi[n] = self._node_hi[c].max(axis=0)
+            self._nactive[n] = self._nactive[c].sum()
+
+    def _refit_up(self, leaves):
+        nodes = set(int(n) for n in leaves)
+        while nodes:
+            for n in sorted(nodes, reverse=True):
+                self._refit(n)
+            nodes = {int(self._parent[n]) for n in nodes
+                     if self._parent[n] >= 0}
+
+    def set_active(self, ids, active=True):
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        ok = np.isfinite(self._lo[ids, 0])
+        changed = ids[ok][self.active[ids[ok]] != bool(active)]
+        if len(changed) == 0:
+            return
+        self.active[changed] = bool(active)
+        self._refit_up(np.unique(self._leaf[changed]))
+
+    def update(self, i, bounds):
+        """block i の箱を変える。変わらなければ何もしない"""
+        b = np.asarray(bounds, dtype=float)
+        lo, hi = b[0::2], b[1::2]
+        if (lo > hi).any():
+            lo, hi = np.full(3, np.inf), np.full(3, -np.inf)
+        if (self._lo[i] == lo).all() and (self._hi[i] == hi).all():
+            return False
+        self._lo[i], self._hi[i] = lo, hi
+        if not np.isfinite(lo[0]):
+            self.active[i] = False
+        self._refit_up([self._leaf[i]])
+        return True
+
+    def _query(self, test, exact=True):
+        """
+        test(lo, hi, blocks) -> (全部入る, 一部でも入る) で木をたどる。
+        blocks は node ではなく block の箱を調べるとき True。
+        全部入る node の下は block を調べない (exact=False のときだけ)。
+        """
+        found = []
+        frontier = np.zeros(1, dtype=np.int64)
+        while len(frontier):
+            frontier = frontier[self._nactive[frontier] > 0]
+            if len(frontier) == 0:
+                break
+            inside, overlap = test(self._node_lo[frontier],
+                                   self._node_hi[frontier], False)
+            if not exact:
+                found += [self._blocks(n) for n in frontier[inside]]
+                overlap &= ~inside
+            rest = frontier[overlap]
+            leaves = rest[self._left[rest] < 0]
+            if len(leaves):
+                ids = np.concatenate([self._blocks(n) for n in leaves])
+                ids = ids[self.active[ids]]
+                found.append(ids[test(self._lo[ids], self._hi[ids], True)[1]])
+            inner = rest[self._left[rest] >= 0]
+            frontier = np.concatenate([self._left[inner], self._right[inner]])
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        ids = np.concatenate(found)
+        return np.sort(ids[self.active[ids]])
+
+    def visible(self, camera, aspect, height, min_pixels=0.0):
+        """視野に入っていて、画面で min_pixels 以上に見える block"""
+        planes = frustum_planes(camera, aspect)
+        normal, d = planes[:, :3], planes[:, 3]
+        position = np.array(camera.GetPosition())
+
+        def test(lo, hi, blocks):
+            # 法線方向に一番遠い頂点でも外側なら視野外、一番近い頂点が
+            # 内側なら全部視野内
+            far = np.where(normal > 0, hi[:, None], lo[:, None])
+            near = np.where(normal > 0, lo[:, None], hi[:, None])
+            with np.errstate(invalid="ignore"):
+                overlap = ~((far * normal).sum(-1) + d < 0).any(1)
+                inside = ((near * normal).sum(-1) + d >= 0).all(1)
+            if min_pixels > 0:
+                # node は一番近いところで見た大きさ (下の block はこれより
+                # 小さい)、block は boundsPixelSize と同じく中心で見た大きさ
+                size = pixel_sizes(
+                    lo, hi, camera, height,
+                    None if blocks else box_distance(lo, hi, position))
+                overlap &= size >= min_pixels
+            return inside, overlap
+
+        return self._query(test, exact=min_pixels > 0)
+
+    def ray(self, p0, p1):
+        """p0 から p1 への線分と箱が交わる block (p0 に近い順)"""
+        p0, p1 = np.asarray(p0, dtype=float), np.asarray(p1, dtype=float)
+        d = p1 - p0
+
+        def entry(lo, hi):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                t0 = (lo - p0) / d
+                t1 = (hi - p0) / d
+            # 軸に平行なら、その軸で箱の中にあるかだけ。外なら t0, t1 とも
+            # +inf にして tmin を +inf にする (min/max で入れ替わらないように)
+            parallel = d == 0
+            within = (lo <= p0) & (p0 <= hi)
+            t0 = np.where(parallel, np.where(within, -np.inf, np.inf), t0)
+            t1 = np.where(parallel, np.inf, t1)
+            tmin = np.minimum(t0, t1).max(axis=1)
+            tmax = np.maximum(t0, t1).min(axis=1)
+            return tmin, tmax
+
+        def test(lo, hi, blocks):
+            tmin, tmax = entry(lo, hi)
+            hit = (tmax >= np.maximum(tmin, 0.0)) & (tmin <= 1.0)
+            return np.zeros(len(lo), dtype=bool), hit
+
+        ids = self._query(test)
+        tmin = entry(self._lo[ids], self._hi[ids])[0]
+        return ids[np.argsort(tmin, kind="stable")]
@@ -0,0 +1,267 @@
+#
+import numpy as np
+
+from vtkmodules.vtkCommonCore import vtkUnsignedCharArray
+from vtkmodules.vtkCommonDataModel import vtkDataObject
+
+CATALOG_INFO = {
+    "page_size": 100,  # client の state に送る配列の数
+    "solid": '<solid>',
+}
+
+ASSOCIATIONS = (vtkDataObject.FIELD_ASSOCIATION_POINTS,
+                vtkDataObject.FIELD_ASSOCIATION_CELLS)
+
+RECORD_DTYPE = np.dtype([
+    ("association", np.int8),
+    ("u_char", np.bool_),
+    ("lo", np.float64),
+    ("hi", np.float64),
+    ("blocks", np.int32),  # 配列を持っている block の数
+])
+
+
+def _fields(ds):
+    return ((ds.GetPointData(), ASSOCIATIONS[0]),
+            (ds.GetCellData(), ASSOCIATIONS[1]))
+
+
+class ArrayInfo:
+    """catalog の 1 つの配列 (<solid> は association が -1)"""
+    __slots__ = ("index", "name", "association", "u_char", "range")
+
+    def __init__(self, index, name, association, u_char, range):
+        self.index = index
+        self.name = name
+        self.association = association
+        self.u_char = u_char
+        self.range = range
+
+    @property
+    def colored(self):
+        """LUT で色をつける配列か"""
+        return self.association >= 0 and not self.u_char
+
+
+class ArrayCatalog:
+    """
+    dataset (composite なら各 block) の配列の一覧。
+
+    配列ごとの情報は structured array (RECORD_DTYPE)、block ごとの range は
+    (配列数, block 数) の配列 (持っていない block は nan) で持つ。
+    全体の range はそこから nanmin/nanmax でまとめる。(名前, association)
+    で引けて、配列を持っている block もわかる。最後の番号は <solid>。
+    """
+
+    def __init__(self, names=(), records=None, block_lo=None, block_hi=None):
+        self._names = list(names)
+        n = len(self._names)
+        self._records = records if records is not None else \
+            np.zeros(n, dtype=RECORD_DTYPE)
+        self._block_lo = block_lo if block_lo is not None else \
+            np.full((n, 0), np.nan)
+        self._block_hi = block_hi if block_hi is not None else \
+            np.full((n, 0), np.nan)
+        self._reindex()
+
+    def _reindex(self):
+        self._lookup = {(name, int(a)): i for i, (name, a) in enumerate(
+            zip(self._names, self._records["association"]))}
+        self._lower = np.array([n.lower() for n in self._names] +
+                               [CATALOG_INFO["solid"]], dtype=str)
+
+    @classmethod
+    def from_blocks(cls, blocks):
+        """blocks (vtkDataSet の list) の配列を集める"""
+        keys = {}  # (name, association) -> 番号
+        u_char = {}
+        entries = []  # (配列の番号, block 番号, lo, hi)
+        for b, ds in enumerate(blocks):
+            for field, association in _fields(ds):
+                for j in range(field.GetNumberOfArrays()):
+                    array = field.GetArray(j)
+                    if array is None or array.GetName() is None:
+                        continue
+                    key = (array.GetName(), association)
+                    i = keys.setdefault(key, len(keys))
+                    u_char[i] = u_char.get(i, False) or \
+                        vtkUnsignedCharArray.SafeDownCast(array) is not None
+                    entries.append((i, b) + tuple(array.GetRange()))
+
+        # 点の配列を先に、それぞれ見つかった順
+        order = sorted(keys, key=lambda k: (ASSOCIATIONS.index(k[1]),
+                                            keys[k]))
+        position = np.empty(len(keys), dtype=np.int64)
+        position[[keys[k] for k in order]] = np.arange(len(keys))
+
+        n = len(keys)
+        block_lo = np.full((n, len(blocks)), np.nan)
+        block_hi = np.full((n, len(blocks)), np.nan)
+        if entries:
+            e = np.array(entries, dtype=np.float64)
+            rows = position[e[:, 0].astype(np.int64)]
+            cols = e[:, 1].astype(np.int64)
+            block_lo[rows, cols] = e[:, 2]
+            block_hi[rows, cols] = e[:, 3]
+
+        records = np.zeros(n, dtype=RECORD_DTYPE)
+        records["association"] = [k[1] for k in order]
+        records["u_char"] = [u_char[keys[k]] for k in order]
+        catalog = cls([k[0] for k in order], records, block_lo, block_hi)
+        catalog._merge_ranges()
+        return catalog
+
+    @classmethod
+    def from_records(cls, arrays):
+        """file index の配列の情報 (block ごとの range はない) から作る"""
+        arrays = list(arrays)
+        records = np.zeros(len(arrays), dtype=RECORD_DTYPE)
+        records["association"] = [a["type"] for a in arrays]
+        records["u_char"] = [a["u_char"] for a in arrays]
+        ranges = np.array([a["range"] if a["range"] is not None else [0, 1]
+                           for a in arrays], dtype=np.float64).reshape(-1, 2)
+        records["lo"], records["hi"] = ranges[:, 0], ranges[:, 1]
+        records["blocks"] = 1
+        return cls([a["name"] for a in arrays], records,
+                   ranges[:, :1].copy(), ranges[:, 1:].copy())
+
+    def _merge_ranges(self, rows=None):
+        """block ごとの range を rows (省略したら全部) の配列でまとめる"""
+        rows = np.arange(len(self._names)) if rows is None else \
+            np.atleast_1d(rows)
+        blocks = (~np.isnan(self._block_lo[rows])).sum(axis=1)
+        self._records["blocks"][rows] = blocks
+        some = rows[blocks > 0]
+        if len(some):
+            self._records["lo"][some] = np.nanmin(self._block_lo[some], axis=1)
+            self._records["hi"][some] = np.nanmax(self._block_hi[some], axis=1)
+
+    def __len__(self):
+        return len(self._names) + 1
+
+    @property
+    def num_blocks(self):
+        return self._block_lo.shape[1]
+
+    @property
+    def solid(self):
+        return len(self._names)
+
+    def __getitem__(self, i):
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if i == self.solid:
+            return ArrayInfo(i, CATALOG_INFO["solid"], -1, False, [0, 255])
+        if not 0 <= i < self.solid:
+            raise IndexError(i)
+        r = self._records[i]
+        return ArrayInfo(i, self._names[i], int(r["association"]),
+                         bool(r["u_char"]), [float(r["lo"]), float(r["hi"])])
+
+    def get(self, i):
+        """i が範囲外なら None"""
+        try:
+            return self[i]
+        except (IndexError, TypeError, ValueError):
+            return None
+
+    def find(self, name, association=None):
+        """名前 (と association) から番号。なければ None"""
+        if association is not None:
+            return self._lookup.get((name, int(association)))
+        for a in ASSOCIATIONS:
+            if (name, a) in self._lookup:
+                return self._lookup[(name, a)]
+        return self.solid if name == CATALOG_INFO["solid"] else None
+
+    def blocks(self, i):
+        """配列 i を持っている block の番号"""
+        if i == self.solid:
+            return np.arange(self.num_blocks)
+        return np.flatnonzero(~np.isnan(self._block_lo[i]))
+
+    def in_block(self, i, block):
+        if i == self.solid or not 0 <= block < self.num_blocks:
+            return True
+        return not np.isnan(self._block_lo[i, block])
+
+    def arrays_in(self, block):
+        """block が持っている配列の番号"""
+        return np.flatnonzero(~np.isnan(self._block_lo[:, block]))
+
+    def merge(self, ds):
+        """
+        別の dataset (piece や比較するファイル) の range を足す。
+        知らない配列は足さない。
+        """
+        rows, lo, hi = [], [], []
+        for field, association in _fields(ds):
+            for j in range(field.GetNumberOfArrays()):
+                array = field.GetArray(j)
+                i = self._lookup.get((array.GetName(), association)) \
+                    if array is not None else None
+                if i is None or self._records["u_char"][i]:
+                    continue
+                r = array.GetRange()
+                rows.append(i)
+                lo.append(r[0])
+                hi.append(r[1])
+        if not rows:
+            return False
+        rows = np.array(rows)
+        self._records["lo"][rows] = np.fmin(self._records["lo"][rows], lo)
+        self._records["hi"][rows] = np.fmax(self._records["hi"][rows], hi)
+        return True
+
+    def add(self, name, association, value_range, blocks=None):
+        """配列を足して番号を返す (<solid> は最後のまま)。あれば range を更新"""
+        i = self.find(name, association)
+        if i is None:
+            i = len(self._names)
+            self._names.append(name)
+            row = np.zeros(1, dtype=RECORD_DTYPE)
+            row["association"] = association
+            self._records = np.concatenate([self._records, row])
+            empty = np.full((1, self.num_blocks), np.nan)
+            self._block_lo = np.vstack([self._block_lo, empty])
+            self._block_hi = np.vstack([self._block_hi, empty])
+        columns = np.arange(self.num_blocks) if blocks is None else \
+            np.asarray(blocks, dtype=np.int64)
+        self._block_lo[i, columns] = value_range[0]
+        self._block_hi[i, columns] = value_range[1]
+        self._merge_ranges(i)
+        if self.num_blocks == 0:
+            self._records["lo"][i], self._records["hi"][i] = value_range
+        self._reindex()
+        return i
+
+    def label(self, i):
+        if i == self.solid:
+            return CATALOG_INFO["solid"]
+        name = self._names[i]
+        n = int(self._records["blocks"][i])
+        if 0 < n < self.num_blocks:
+            # 一部の block にしかない配列
+            return f"{name} ({n}/{self.num_blocks})"
+        return name
+
+    def view(self, query="", offset=0, limit=None, selected=None):
+        """
+        client の state に送る分だけ: ([{"text", "value"}], 一致した数)。
+        query は名前の一部 (大文字小文字は区別しない)。selected は
+        ページの外でも入れておく (選択中の表示が消えないように)。
+        """
+        if limit is None:
+            limit = CATALOG_INFO["page_size"]
+        query = (query or "").strip().lower()
+        if query:
+            hits = np.flatnonzero(np.char.find(self._lower, query) >= 0)
+        else:
+            hits = np.arange(len(self))
+        page = hits[offset:offset + limit].tolist()
+        if selected is not None and 0 <= selected < len(self) and \
+                selected not in page:
+            page.append(int(selected))
+        return [{"text": self.label(i), "value": int(i)} for i in page], \
+            len(hits)
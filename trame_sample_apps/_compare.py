@@ -0,0 +1,173 @@
+#
+import numpy as np
+
+from vtkmodules.util.numpy_support import vtk_to_numpy, numpy_to_vtk
+from vtkmodules.vtkCommonDataModel import (
+    vtkCompositeDataSet,
+    vtkDataObject,
+    vtkDataObjectTreeIterator,
+    vtkDataSet,
+    vtkImageData,
+    vtkPointSet,
+    vtkPolyData,
+    vtkRectilinearGrid,
+    vtkUnstructuredGrid,
+)
+
+
+def leaves(data_obj):
+    """[(block 名, vtkDataSet), ...] (dataset 1 つなら名前は "")"""
+    ds = vtkDataSet.SafeDownCast(data_obj)
+    if ds is not None:
+        return [("", ds)]
+
+    result = []
+    iter = vtkDataObjectTreeIterator()
+    iter.SetDataSet(data_obj)
+    iter.SkipEmptyNodesOn()
+    iter.VisitOnlyLeavesOn()
+    iter.InitTraversal()
+    while not iter.IsDoneWithTraversal():
+        ds = vtkDataSet.SafeDownCast(iter.GetCurrentDataObject())
+        if ds is not None:
+            info = iter.GetCurrentMetaData()
+            name = ""
+            if info.Has(vtkCompositeDataSet.NAME()):
+                name = info.Get(vtkCompositeDataSet.NAME())
+            result.append((name, ds))
+        iter.GoToNextItem()
+    return result
+
+
+def _arrays(ds):
+    """topology を決める配列 (点座標と cell の接続)"""
+    arrays = []
+    if isinstance(ds, vtkPointSet) and ds.GetPoints() is not None:
+        arrays.append(ds.GetPoints().GetData())
+    if isinstance(ds, vtkUnstructuredGrid):
+        cells = ds.GetCells()
+        arrays += [cells.GetConnectivityArray(), cells.GetOffsetsArray(),
+                   ds.GetCellTypesArray()]
+    elif isinstance(ds, vtkPolyData):
+        for cells in (ds.GetVerts(), ds.GetLines(), ds.GetPolys(),
+                      ds.GetStrips()):
+            arrays += [cells.GetConnectivityArray(), cells.GetOffsetsArray()]
+    elif isinstance(ds, vtkRectilinearGrid):
+        arrays += [ds.GetXCoordinates(), ds.GetYCoordinates(),
+                   ds.GetZCoordinates()]
+    return [a for a in arrays if a is not None]
+
+
+def _grid(ds):
+    if isinstance(ds, vtkImageData):
+        return (ds.GetDimensions(), ds.GetOrigin(), ds.GetSpacing())
+    if hasattr(ds, "GetDimensions"):
+        return ds.GetDimensions()
+    return None
+
+
+def same_topology(a, b):
+    """点座標と cell の接続が同じか (中身を比べる)"""
+    if a.GetClassName() != b.GetClassName() or \
+            a.GetNumberOfPoints() != b.GetNumberOfPoints() or \
+            a.GetNumberOfCells() != b.GetNumberOfCells() or \
+            _grid(a) != _grid(b):
+        return False
+    xs, ys = _arrays(a), _arrays(b)
+    if len(xs) != len(ys):
+        return False
+    return all(np.array_equal(vtk_to_numpy(x), vtk_to_numpy(y))
+               for x, y in zip(xs, ys))
+
+
+def shares_topology(a, b):
+    """share_topology() で作ったものか (同じ配列を使っているか)"""
+    xs, ys = _arrays(a), _arrays(b)
+    if len(xs) != len(ys) or _grid(a) != _grid(b):
+        return False
+    return all(x is y for x, y in zip(xs, ys))
+
+
+def share_topology(ref, ds):
+    """ref の点と cell をそのまま使い、field だけ ds のものにする"""
+    result = ref.NewInstance()
+    result.ShallowCopy(ref)
+    result.GetPointData().ShallowCopy(ds.GetPointData())
+    result.GetCellData().ShallowCopy(ds.GetCellData())
+    result.GetFieldData().ShallowCopy(ds.GetFieldData())
+    return result
+
+
+def dedupe(data_obj, refs):
+    """
+    data_obj の block のうち refs と topology が同じものを
+    share_topology() したものに置き換える。置き換えた数を返す。
+    """
+    ds = vtkDataSet.SafeDownCast(data_obj)
+    if ds is not None:
+        if refs and same_topology(refs[0], ds):
+            data_obj.ShallowCopy(share_topology(refs[0], ds))
+            return 1
+        return 0
+
+    count = 0
+    iter = vtkDataObjectTreeIterator()
+    iter.SetDataSet(data_obj)
+    iter.SkipEmptyNodesOn()
+    iter.VisitOnlyLeavesOn()
+    iter.InitTraversal()
+    n = 0
+    while not iter.IsDoneWithTraversal():
+        ds = vtkDataSet.SafeDownCast(iter.GetCurrentDataObject())
+        if ds is not None:
+            if n < len(refs) and same_topology(refs[n], ds):
+                data_obj.SetDataSet(iter, share_topology(refs[n], ds))
+                count += 1
+            n += 1
+        iter.GoToNextItem()
+    return count
+
+
+def _take(field, ids):
+    result = field.NewInstance()
+    for i in range(field.GetNumberOfArrays()):
+        array = field.GetAbstractArray(i)
+        values = vtk_to_numpy(array)
+        taken = numpy_to_vtk(np.ascontiguousarray(values[ids]), deep=1,
+                             array_type=array.GetDataType())
+        taken.SetName(array.GetName())
+        result.AddArray(taken)
+    return result
+
+
+def share_surface(ref_surface, point_ids, cell_ids, ds):
+    """
+    ref の surface (点と cell) を使い回して、ds の field を載せる。
+    point_ids, cell_ids は surface から元の dataset への番号。
+    """
+    result = vtkPolyData()
+    result.CopyStructure(ref_surface)
+    if point_ids is None:
+        result.GetPointData().ShallowCopy(ds.GetPointData())
+        result.GetCellData().ShallowCopy(ds.GetCellData())
+    else:
+        result.GetPointData().ShallowCopy(_take(ds.GetPointData(),
+                                                point_ids))
+        result.GetCellData().ShallowCopy(_take(ds.GetCellData(), cell_ids))
+    return result
+
+
+def difference(ref, ds, name, association):
+    """ds - ref (同じ topology のときだけ。違えば None)"""
+    if association == vtkDataObject.FIELD_ASSOCIATION_POINTS:
+        a, b = ref.GetPointData().GetArray(name), \
+            ds.GetPointData().GetArray(name)
+    else:
+        a, b = ref.GetCellData().GetArray(name), \
+            ds.GetCellData().GetArray(name)
+    if a is None or b is None:
+        return None
+    a, b = vtk_to_numpy(a), vtk_to_numpy(b)
+    if a.shape != b.shape:
+        return None
+    return b.astype(np.float64) - a.astype(np.float64)
@@ -0,0 +1,354 @@
+#
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+
+from vtkmodules.vtkCommonCore import vtkUnsignedCharArray
+from vtkmodules.vtkCommonDataModel import (
+    vtkCompositeDataSet,
+    vtkDataObject,
+)
+from vtkmodules.vtkIOXML import vtkXMLReader
+
+from ._catalog import ArrayCatalog
+from ._compare import leaves
+
+POINTS = vtkDataObject.FIELD_ASSOCIATION_POINTS
+CELLS = vtkDataObject.FIELD_ASSOCIATION_CELLS
+
+_TAG = re.compile(rb'<(/?)(\w+)([^>]*)>')
+_ATTR = re.compile(rb'(\w+)="([^"]*)"')
+_CELL_COUNTS = ("NumberOfCells", "NumberOfVerts", "NumberOfLines",
+                "NumberOfStrips", "NumberOfPolys")
+
+
+_MARKUP = re.compile(rb'<[^<>]*>')
+
+
+def _xml_header(path, chunk=1 << 20, limit=64 << 20):
+    """
+    XML ファイルの AppendedData より前のタグだけ (間の inline の配列は
+    読み飛ばして持たない)。(タグ, 最後まで読めたか)。limit byte 読んだら
+    そこで止める。
+    """
+    parts = []
+    tail = b''
+    size = 0
+    with open(path, 'rb') as f:
+        while size < limit:
+            buf = f.read(chunk)
+            if not buf:
+                break
+            size += len(buf)
+            buf = tail + buf
+            end = 0
+            for m in _MARKUP.finditer(buf):
+                if m.group().startswith(b'<AppendedData'):
+                    return b''.join(parts), True
+                parts.append(m.group())
+                end = m.end()
+            # 途中で切れたタグは次の chunk とつなぐ
+            i = buf.find(b'<', end)
+            tail = buf[i:] if i >= 0 and len(buf) - i < chunk else b''
+        complete = not f.read(1)
+    return b''.join(parts), complete
+
+
+def _extent_size(extent):
+    e = [int(x) for x in extent.split()]
+    dims = [e[1] - e[0] + 1, e[3] - e[2] + 1, e[5] - e[4] + 1]
+    cells = 1
+    for d in dims:
+        cells *= max(d - 1, 1)
+    return dims[0] * dims[1] * dims[2], cells
+
+
+def _merge_array(arrays, name, association, r, u_char):
+    key = (name, association)
+    arr = arrays.get(key)
+    if arr is None:
+        arrays[key] = {"name": name, "type": association, "range": r,
+                       "u_char": u_char}
+    elif r is not None:
+        if arr["range"] is None:
+            arr["range"] = r
+        else:
+            arr["range"] = [min(arr["range"][0], r[0]),
+                            max(arr["range"][1], r[1])]
+
+
+def scan_xml(path, info=None):
+    """
+    XML 形式はヘッダだけ読む。range はファイルに書いてある RangeMin/Max
+    (多成分の配列は大きさの range)。bounds は ImageData 以外わからない。
+    ヘッダが大きすぎて途中までしか読めなかったら info["partial"] = True。
+    """
+    if info is None:
+        info = {"points": 0, "cells": 0, "arrays": {}, "blocks": [],
+                "bounds": None}
+    section = None
+    header, complete = _xml_header(path)
+    if not complete:
+        info["partial"] = True
+    for m in _TAG.finditer(header):
+        close, tag = m.group(1), m.group(2).decode()
+        attrs = {k.decode(): v.decode() for k, v in _ATTR.findall(m.group(3))}
+        selfclose = m.group(3).endswith(b'/')
+        if tag in ("PointData", "CellData"):
+            section = None if close or selfclose else tag
+        elif close:
+            continue
+        elif tag == "ImageData" and "WholeExtent" in attrs:
+            e = [int(x) for x in attrs["WholeExtent"].split()]
+            o = [float(x) for x in attrs.get("Origin", "0 0 0").split()]
+            s = [float(x) for x in attrs.get("Spacing", "1 1 1").split()]
+            info["bounds"] = [o[i // 2] + s[i // 2] * e[i] for i in range(6)]
+        elif tag == "Piece":
+            if "NumberOfPoints" in attrs:
+                info["points"] += int(attrs["NumberOfPoints"])
+                info["cells"] += sum(int(attrs.get(k, 0))
+                                     for k in _CELL_COUNTS)
+            elif "Extent" in attrs:
+                p, c = _extent_size(attrs["Extent"])
+                info["points"] += p
+                info["cells"] += c
+        elif tag == "DataArray" and section is not None and "Name" in attrs:
+            r = None
+            if attrs.get("RangeMin", "") and attrs.get("RangeMax", ""):
+                r = [float(attrs["RangeMin"]), float(attrs["RangeMax"])]
+            _merge_array(info["arrays"], attrs["Name"],
+                         POINTS if section == "PointData" else CELLS,
+                         r, attrs.get("type") == "UInt8")
+        elif tag == "DataSet" and attrs.get("file"):
+            # vtm: block ごとのファイルのヘッダを読む
+            info["blocks"].append(attrs.get("name", ""))
+            child = os.path.join(os.path.dirname(path), attrs["file"])
+            if os.path.exists(child):
+                scan_xml(child, info)
+    return info
+
+
+def _bounds(data_obj):
+    if data_obj is None or not hasattr(data_obj, "GetBounds"):
+        return None
+    if vtkCompositeDataSet.SafeDownCast(data_obj) is not None:
+        bounds = [0.0] * 6
+        data_obj.GetBounds(bounds)
+        return bounds
+    return list(data_obj.GetBounds())
+
+
+def _geometry_bounds(readercls, path):
+    """配列は読まずに点と cell だけ読んで bounds を出す"""
+    reader = readercls()
+    reader.SetFileName(path)
+    for name in ("GetPointDataArraySelection", "GetCellDataArraySelection"):
+        if hasattr(reader, name):
+            getattr(reader, name)().DisableAllArrays()
+    reader.Update()
+    return _bounds(reader.GetOutputDataObject(0))
+
+
+def scan_full(readercls, path):
+    """ヘッダのない形式は全部読んで generate_actors と同じ情報を集める"""
+    reader = readercls()
+    reader.SetFileName(path)
+    reader.Update()
+    if reader.GetErrorCode() != 0:
+        raise RuntimeError('Cannot open: ' + path)
+    data_obj = reader.GetOutputDataObject(0)
+    info = {"points": 0, "cells": 0, "arrays": {}, "blocks": [],
+            "bounds": _bounds(data_obj)}
+    composite = vtkCompositeDataSet.SafeDownCast(data_obj) is not None
+    for name, ds in leaves(data_obj):
+        if composite:
+            info["blocks"].append(name)
+        info["points"] += ds.GetNumberOfPoints()
+        info["cells"] += ds.GetNumberOfCells()
+        fields = ((ds.GetPointData(), POINTS), (ds.GetCellData(), CELLS))
+        for field, association in fields:
+            for i in range(field.GetNumberOfArrays()):
+                array = field.GetArray(i)
+                if array is None:
+                    continue
+                uc = vtkUnsignedCharArray.SafeDownCast(array)
+                _merge_array(info["arrays"], array.GetName(), association,
+                             list(array.GetRange()), uc is not None)
+    return info
+
+
+def scan_file(readercls, path):
+    info = None
+    if issubclass(readercls, vtkXMLReader):
+        info = scan_xml(path)
+        if info.pop("partial", False):
+            # ヘッダを読み切れないと点や cell の数が足りないので、全部読む
+            info = None
+        elif info["bounds"] is None:
+            info["bounds"] = _geometry_bounds(readercls, path)
+    if info is None:
+        info = scan_full(readercls, path)
+    info["arrays"] = list(info["arrays"].values())
+    return info
+
+
+def dataset_arrays(record):
+    """index の情報から配列の catalog (ArrayCatalog) を作る"""
+    return ArrayCatalog.from_records(record.get("arrays", []))
+
+
+class FileIndex:
+    """
+    ファイルごとの metadata (形式, bounds, 点と cell の数, 配列, block 名)
+    の索引。拡張子が .json なら JSON、それ以外は SQLite に置く。
+    refresh() は mtime と size が変わったファイルだけ読み直す。
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._json = path.endswith('.json')
+        self._lock = threading.Lock()
+        self._records = {}
+        self._db = None
+        if self._json:
+            if os.path.exists(path):
+                with open(path) as f:
+                    self._records = json.load(f)
+        else:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                " path TEXT PRIMARY KEY, mtime REAL, size INTEGER,"
+                " format TEXT, names TEXT, meta TEXT)")
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _stamps(self):
+        if self._json:
+            return {p: (r["mtime"], r["size"])
+                    for p, r in self._records.items()}
+        rows = self._db.execute("SELECT path, mtime, size FROM files")
+        return {p: (m, s) for p, m, s in rows}
+
+    def _put(self, record):
+        if self._json:
+            self._records[record["path"]] = record
+            return
+        names = " ".join([a["name"] for a in record.get("arrays", [])] +
+                         record.get("blocks", []))
+        self._db.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+            (record["path"], record["mtime"], record["size"],
+             record["format"], names.lower(), json.dumps(record)))
+
+    def _delete(self, paths):
+        if self._json:
+            for p in paths:
+                self._records.pop(p, None)
+        else:
+            self._db.executemany("DELETE FROM files WHERE path = ?",
+                                 [(p,) for p in paths])
+
+    def _save(self):
+        if self._json:
+            tmp = self._path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self._records, f)
+            os.replace(tmp, self._path)
+        else:
+            self._db.commit()
+
+    def refresh(self, roots, readers, debug=False):
+        """roots の下を調べて索引を更新する。(追加, 更新, 削除, 変更なし)"""
+        added = updated = unchanged = 0
+        with self._lock:
+            stamps = self._stamps()
+            seen = set()
+            for root in roots:
+                root = os.path.abspath(root)
+                for dirpath, dirnames, filenames in os.walk(root):
+                    dirnames.sort()
+                    for filename in sorted(filenames):
+                        ext = os.path.splitext(filename)[1].lower()
+                        readercls = readers.get(ext)
+                        if readercls is None:
+                            continue
+                        path = os.path.join(dirpath, filename)
+                        try:
+                            st = os.stat(path)
+                        except OSError as e:
+                            # 壊れた symlink など。索引からも消す
+                            if debug:
+                                print('skip', path, e)
+                            continue
+                        seen.add(path)
+                        old = stamps.get(path)
+                        if old == (st.st_mtime, st.st_size):
+                            unchanged += 1
+                            continue
+                        t = time.perf_counter()
+                        record = {"path": path, "mtime": st.st_mtime,
+                                  "size": st.st_size, "format": ext[1:]}
+                        try:
+                            record.update(scan_file(readercls, path))
+                        except Exception as e:
+                            record["error"] = str(e)
+                        if debug:
+                            print(f'{time.perf_counter() - t:.3f}s', path,
+                                  record.get("error", ""))
+                        self._put(record)
+                        if old is None:
+                            added += 1
+                        else:
+                            updated += 1
+            # roots の下で無くなったファイルは消す
+            prefixes = tuple(os.path.join(os.path.abspath(r), '')
+                             for r in roots)
+            removed = [p for p in stamps
+                       if p.startswith(prefixes) and p not in seen]
+            self._delete(removed)
+            self._save()
+        return added, updated, len(removed), unchanged
+
+    def get(self, path):
+        with self._lock:
+            if self._json:
+                return self._records.get(path)
+            row = self._db.execute("SELECT meta FROM files WHERE path = ?",
+                                   (path,)).fetchone()
+            return json.loads(row[0]) if row else None
+
+    def query(self, text="", limit=100, offset=0):
+        """
+        空白で区切った語を全部含む (パス, 配列名, block 名) ものを探す。
+        (該当数, [record, ...])
+        """
+        words = (text or "").lower().split()
+        with self._lock:
+            if self._json:
+                found = [r for p, r in sorted(self._records.items())
+                         if all(w in (p.lower() + " " + " ".join(
+                             [a["name"].lower()
+                              for a in r.get("arrays", [])] +
+                             [b.lower() for b in r.get("blocks", [])]))
+                             for w in words)]
+                end = None if limit is None else offset + limit
+                return len(found), found[offset:end]
+
+            where = " AND ".join(
+                ["(lower(path) LIKE ? OR names LIKE ?)"] * len(words))
+            where = " WHERE " + where if where else ""
+            args = [x for w in words for x in (f"%{w}%", f"%{w}%")]
+            total = self._db.execute(
+                "SELECT count(*) FROM files" + where, args).fetchone()[0]
+            rows = self._db.execute(
+                "SELECT meta FROM files" + where +
+                " ORDER BY path LIMIT ? OFFSET ?",
+                args + [-1 if limit is None else limit, offset])
+            return total, [json.loads(r[0]) for r in rows]
@@ -0,0 +1,111 @@
+#
+import math
+import threading
+
+import numpy as np
+
+from vtkmodules.util.numpy_support import vtk_to_numpy
+from vtkmodules.vtkFiltersSources import vtkSphereSource
+from vtkmodules.vtkFiltersHybrid import vtkEarthSource
+
+LOD_INFO = {
+    "pixel_error": 0.5,  # 本当の形からのずれを画面で何 pixel まで許すか
+    "view_height": 800,  # client から大きさが来るまでの仮の値
+    "sphere_levels": [8, 16, 32, 64, 128, 256, 512],  # theta 方向の分割数
+    "earth_levels": [16, 8, 4, 2, 1],  # vtkEarthSource の OnRatio
+}
+
+
+class ProceduralLOD:
+    """
+    パラメータで形が決まる source の LOD。
+
+    levels は粗い順に並べた parameter。build(level) で作った polydata は
+    level ごとに 1 回だけ作って使い回す。error(level) はその level での
+    本当の形からのずれ (world 座標)。
+    """
+
+    def __init__(self, build, levels, error):
+        self._build = build
+        self._levels = list(levels)
+        self._error = error
+        self._cache = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    @property
+    def levels(self):
+        return list(self._levels)
+
+    def get(self, level):
+        with self._lock:
+            if level not in self._cache:
+                self._cache[level] = self._build(level)
+            return self._cache[level]
+
+    def choose(self, pixels_per_unit, pixel_error=None):
+        """画面でのずれが pixel_error 以下になる一番粗い level"""
+        if pixel_error is None:
+            pixel_error = LOD_INFO["pixel_error"]
+        for level in self._levels:
+            if level not in self._errors:
+                self._errors[level] = self._error(level)
+            if self._errors[level] * pixels_per_unit <= pixel_error:
+                return level
+        return self._levels[-1]
+
+
+def sphere_lod(radius, levels=None):
+    def build(theta):
+        s = vtkSphereSource()
+        s.SetThetaResolution(theta)
+        s.SetPhiResolution(max(theta // 2, 4))
+        s.SetRadius(radius)
+        s.Update()
+        return s.GetOutput()
+
+    def error(theta):
+        # 輪郭の弦と円のずれ (sagitta)
+        return radius * (1 - math.cos(math.pi / theta))
+    return ProceduralLOD(build, levels or LOD_INFO["sphere_levels"], error)
+
+
+def polyline_error(polydata, step):
+    """
+    折れ線の点を step 個おきに間引いたときの、元の点と弦の距離の最大。
+    (各折れ線の最後の点は残す。平均だと海岸線の突き出たところなどが
+    pixel_error を超えても選ばれてしまう)
+    """
+    points = vtk_to_numpy(polydata.GetPoints().GetData())
+    lines = polydata.GetLines()
+    conn = vtk_to_numpy(lines.GetConnectivityArray())
+    offsets = vtk_to_numpy(lines.GetOffsetsArray())
+    start = np.repeat(offsets[:-1], np.diff(offsets))
+    end = np.repeat(offsets[1:] - 1, np.diff(offsets))
+    j = np.arange(len(conn))
+    a = start + (j - start) // step * step
+    b = np.minimum(a + step, end)
+    p, pa, pb = points[conn[j]], points[conn[a]], points[conn[b]]
+    ab = pb - pa
+    t = np.einsum('ij,ij->i', p - pa, ab) / \
+        np.maximum(np.einsum('ij,ij->i', ab, ab), 1e-30)
+    d = p - (pa + ab * np.clip(t, 0, 1)[:, None])
+    return float(np.linalg.norm(d, axis=1).max()) if len(d) else 0.0
+
+
+def earth_lod(radius, levels=None):
+    def build(on_ratio):
+        e = vtkEarthSource()
+        e.OutlineOn()
+        e.SetOnRatio(on_ratio)
+        e.SetRadius(radius)
+        e.Update()
+        return e.GetOutput()
+
+    lod = None
+
+    def error(on_ratio):
+        # OnRatio は点を間引くだけなので、一番細かいものを間引いて測る
+        return polyline_error(lod.get(1), on_ratio)
+    lod = ProceduralLOD(build, levels or LOD_INFO["earth_levels"], error)
+    return lod
@@ -0,0 +1,185 @@
+#
+import numpy as np
+
+from vtkmodules.util.numpy_support import vtk_to_numpy
+from vtkmodules.vtkCommonDataModel import (
+    vtkDataObject,
+    vtkPlane,
+    vtkUnstructuredGrid,
+)
+from vtkmodules.vtkFiltersCore import (
+    vtkExtractCells,
+    vtkPlaneCutter,
+    vtkThreshold,
+)
+from vtkmodules.vtkFiltersGeneral import vtkTableBasedClipDataSet
+
+
+class FilterPipeline:
+    """
+    reader の後ろに threshold -> clip -> slice をつなぐ。
+
+    execute() は worker thread で呼ばれる。各 stage の出力はパラメータを
+    key にして cache し、上流が変わらない限り再利用する。
+    threshold 用の索引 (cell: ソート済み index, point: cell ごとの min/max)
+    と slice 用の sphere tree も 1 回だけ作る。
+    """
+
+    def __init__(self, ds, display=None):
+        self._source = ds
+        self._display = display if display is not None else ds
+        self._index = {}  # (name, association) -> 索引
+        self._cache = {}  # stage -> (params, upstream, output)
+        self._running = None
+        self._aborted = False
+
+        self._cutter = vtkPlaneCutter()
+        self._cutter.BuildTreeOn()
+        self._cutter.BuildHierarchyOn()
+
+    @property
+    def source(self):
+        return self._source
+
+    def abort(self):
+        self._aborted = True
+        alg = self._running
+        if alg is not None:
+            alg.AbortExecuteOn()
+
+    def _update(self, alg):
+        self._running = alg
+        alg.AbortExecuteOff()
+        alg.Update()
+        self._running = None
+        if self._aborted:
+            raise InterruptedError()
+        # filter を使い回すこともあるので、出力は別 object にしておく
+        output = alg.GetOutputDataObject(0)
+        result = output.NewInstance()
+        result.ShallowCopy(output)
+        return result
+
+    def _stage(self, name, params, func, upstream):
+        # id() は解放された object のものが使い回されることがあるので、
+        # 上流の object そのものを持っておいて is で比べる
+        cached = self._cache.get(name)
+        if cached is not None and cached[0] == params and \
+                cached[1] is upstream:
+            return cached[2]
+        output = func(upstream, params)
+        self._cache[name] = (params, upstream, output)
+        return output
+
+    def execute(self, params):
+        """params: {"threshold": ..., "clip": ..., "slice": ...}
+
+        中断されたら None を返す (途中結果は cache しない)
+        """
+        self._aborted = False
+        output = self._source
+        try:
+            if params.get("threshold") is not None:
+                output = self._stage("threshold", params["threshold"],
+                                     self._threshold, output)
+            if params.get("clip") is not None:
+                output = self._stage("clip", params["clip"],
+                                     self._clip, output)
+            if params.get("slice") is not None:
+                output = self._stage("slice", params["slice"],
+                                     self._slice, output)
+        except InterruptedError:
+            return None
+        if output is self._source:
+            # filter なしのときは元の表示用データ (共有 surface など)
+            return self._display
+        return output
+
+    def _values(self, array):
+        values = vtk_to_numpy(array)
+        if values.ndim > 1:
+            # range ("GetRange()") と同じく component 0 を使う
+            values = values[:, 0]
+        return values
+
+    def _build_index(self, name, association):
+        ds = self._source
+        if association == vtkDataObject.FIELD_ASSOCIATION_CELLS:
+            array = ds.GetCellData().GetArray(name)
+            if array is None:
+                return None
+            values = self._values(array)
+            order = np.argsort(values, kind='stable')
+            return ("sorted", values[order], order)
+
+        array = ds.GetPointData().GetArray(name)
+        if array is None or not isinstance(ds, vtkUnstructuredGrid):
+            return None
+        values = self._values(array)
+        cells = ds.GetCells()
+        conn = vtk_to_numpy(cells.GetConnectivityArray())
+        offsets = vtk_to_numpy(cells.GetOffsetsArray())
+        if len(conn) == 0:
+            return None
+        v = values[conn]
+        # 点のない cell は reduceat で隣の値になってしまうので外して、
+        # nan (どの範囲にも入らない) にしておく
+        filled = np.diff(offsets) > 0
+        starts = offsets[:-1][filled]
+        cmin = np.full(len(filled), np.nan)
+        cmax = np.full(len(filled), np.nan)
+        cmin[filled] = np.minimum.reduceat(v, starts)
+        cmax[filled] = np.maximum.reduceat(v, starts)
+        return ("minmax", cmin, cmax)
+
+    def _threshold(self, ds, params):
+        name, association, lo, hi = params
+        key = (name, association)
+        if key not in self._index:
+            self._index[key] = self._build_index(name, association)
+        index = self._index[key]
+
+        if index is None:
+            # 索引が作れないデータ型は vtkThreshold で
+            f = vtkThreshold()
+            f.SetInputData(ds)
+            f.SetInputArrayToProcess(0, 0, 0, association, name)
+            f.SetLowerThreshold(lo)
+            f.SetUpperThreshold(hi)
+            f.SetThresholdFunction(vtkThreshold.THRESHOLD_BETWEEN)
+            return self._update(f)
+
+        if index[0] == "sorted":
+            _, values, order = index
+            i0 = np.searchsorted(values, lo, side='left')
+            i1 = np.searchsorted(values, hi, side='right')
+            ids = np.sort(order[i0:i1])
+        else:
+            _, cmin, cmax = index
+            ids = np.nonzero((cmin >= lo) & (cmax <= hi))[0]
+
+        f = vtkExtractCells()
+        f.SetInputData(ds)
+        ids = np.ascontiguousarray(ids, dtype=np.int64)
+        f.SetCellIds(ids, len(ids))
+        return self._update(f)
+
+    def _plane(self, params):
+        origin, normal = params
+        plane = vtkPlane()
+        plane.SetOrigin(origin)
+        plane.SetNormal(normal)
+        return plane
+
+    def _clip(self, ds, params):
+        f = vtkTableBasedClipDataSet()
+        f.SetInputData(ds)
+        f.SetClipFunction(self._plane(params))
+        f.InsideOutOn()
+        return self._update(f)
+
+    def _slice(self, ds, params):
+        # 入力が同じなら sphere tree は再利用される
+        self._cutter.SetInputData(ds)
+        self._cutter.SetPlane(self._plane(params))
+        return self._update(self._cutter)
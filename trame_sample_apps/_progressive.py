@@ -0,0 +1,144 @@
+#
+from vtkmodules.vtkIOXML import (
+    vtkXMLDataReader,
+    vtkXMLUnstructuredDataReader,
+)
+from vtkmodules.vtkCommonCore import vtkIdList
+from vtkmodules.vtkFiltersCore import vtkExtractCells
+
+from ._base import boundsInFrustum, boundsPixelSize
+
+
+class ProgressiveLoader:
+    """
+    XML の piece / update-extent を使って、データを少しずつ読み込む。
+
+    - preview(): piece 0 を間引いたものを返す (最初の表示用)
+    - read_piece(): 1 piece 読む (worker thread から呼ばれる)
+    - next_piece(), evict(): メモリ上限 (MB) と視野から読む/捨てる piece を決める
+    """
+
+    def __init__(self, readercls, filename, num_pieces=8, memory_limit=1024,
+                 preview_cells=100000, min_pixels=2.0, debug=False):
+        self._readercls = readercls
+        self._filename = filename
+        self._memory_limit = memory_limit * 1024  # KiB
+        self._preview_cells = preview_cells
+        self._min_pixels = min_pixels
+        self._debug = debug
+
+        self._pieces = {}  # piece -> dataset
+        self._bounds = {}  # piece -> bounds (evict 後も残す)
+        self._failed = set()  # 読めなかった piece (もう読まない)
+
+        reader = self._new_reader()
+        reader.UpdateInformation()
+        if isinstance(reader, vtkXMLUnstructuredDataReader):
+            # ファイル内の piece 数より細かくは分けられない
+            num_pieces = min(num_pieces, reader.GetNumberOfPieces())
+        self._num_pieces = max(1, num_pieces)
+        if self._debug:
+            print('progressive: pieces', self._num_pieces)
+
+    @staticmethod
+    def supports(readercls):
+        return issubclass(readercls, vtkXMLDataReader)
+
+    @property
+    def num_pieces(self):
+        return self._num_pieces
+
+    @property
+    def memory(self):
+        return sum(ds.GetActualMemorySize() for ds in self._pieces.values())
+
+    @property
+    def bounds(self):
+        bounds = None
+        for b in self._bounds.values():
+            if bounds is None:
+                bounds = list(b)
+            else:
+                bounds = [min(bounds[0], b[0]), max(bounds[1], b[1]),
+                          min(bounds[2], b[2]), max(bounds[3], b[3]),
+                          min(bounds[4], b[4]), max(bounds[5], b[5])]
+        return bounds
+
+    def _new_reader(self):
+        reader = self._readercls()
+        reader.SetFileName(self._filename)
+        return reader
+
+    def read_piece(self, piece):
+        # thread ごとに reader を作る
+        reader = self._new_reader()
+        reader.UpdatePiece(piece, self._num_pieces, 0)
+        if reader.GetErrorCode() != 0:
+            raise RuntimeError('Cannot open: ' + self._filename)
+        ds = reader.GetOutput().NewInstance()
+        ds.ShallowCopy(reader.GetOutput())
+        return ds
+
+    def preview(self):
+        ds = self.read_piece(0)
+        n = ds.GetNumberOfCells()
+        if n <= self._preview_cells:
+            return ds
+
+        step = -(-n // self._preview_cells)
+        ids = vtkIdList()
+        for i in range(0, n, step):
+            ids.InsertNextId(i)
+        f = vtkExtractCells()
+        f.SetInputData(ds)
+        f.SetCellList(ids)
+        f.Update()
+        if self._debug:
+            print('progressive: preview cells',
+                  f.GetOutput().GetNumberOfCells())
+        return f.GetOutput()
+
+    def add(self, piece, ds):
+        self._pieces[piece] = ds
+        self._bounds[piece] = ds.GetBounds()
+
+    def fail(self, piece):
+        self._failed.add(piece)
+
+    def _visible(self, piece, view):
+        b = self._bounds.get(piece)
+        if b is None:
+            return True
+        camera, aspect, height = view
+        return boundsInFrustum(camera, aspect, b) and \
+            boundsPixelSize(camera, height, b) >= self._min_pixels
+
+    def evict(self, view):
+        """視野外 or 画面上で小さすぎる piece を、上限を下回るまで捨てる"""
+        evicted = []
+        memory = self.memory
+        if memory <= self._memory_limit:
+            return evicted
+
+        camera, aspect, height = view
+        candidates = [p for p in self._pieces if not self._visible(p, view)]
+        candidates.sort(key=lambda p: boundsPixelSize(camera, height,
+                                                      self._bounds[p]))
+        for p in candidates:
+            if memory <= self._memory_limit:
+                break
+            memory -= self._pieces.pop(p).GetActualMemorySize()
+            evicted.append(p)
+        if self._debug and evicted:
+            print('progressive: evicted', evicted)
+        return evicted
+
+    def next_piece(self, view):
+        """次に読む piece (なければ None)"""
+        if self.memory >= self._memory_limit:
+            return None
+        for p in range(self._num_pieces):
+            if p not in self._pieces and p not in self._failed and \
+                    self._visible(p, view):
+                return p
+        return None
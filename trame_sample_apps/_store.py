@@ -0,0 +1,139 @@
+#
+import os
+import time
+import threading
+
+
+class _Entry:
+    __slots__ = ("value", "refs", "last_used", "derived")
+
+    def __init__(self, value):
+        self.value = value
+        self.refs = 0
+        self.last_used = time.monotonic()
+        self.derived = {}
+
+
+class DatasetStore:
+    """
+    プロセス内の全 session で共有する、参照カウント付きのデータ置き場。
+
+    読み込んだ dataset と、そこから作ったもの (surface など) を key ごとに
+    1 つだけ持つ。参照がなくなった entry は idle_timeout 秒後に捨てる。
+    session ごとに持つのは renderer, camera, state だけ。
+    """
+
+    def __init__(self, idle_timeout=0):
+        self._idle_timeout = idle_timeout
+        self._entries = {}
+        self._shared = {}  # dataset によらないもの (LUT など)
+        self._pending = {}  # 作っている途中のもの -> threading.Event
+        self._lock = threading.RLock()
+
+    @property
+    def idle_timeout(self):
+        return self._idle_timeout
+
+    @idle_timeout.setter
+    def idle_timeout(self, value):
+        self._idle_timeout = value
+
+    @staticmethod
+    def file_key(filename):
+        path = os.path.abspath(filename)
+        return (path, os.path.getmtime(path))
+
+    def _build(self, token, lookup, insert, factory):
+        """
+        lookup() -> (あるか, 値) で見つからなければ factory() で作って
+        insert(値) で入れる。factory() は lock の外で呼ぶので、読み込み中も
+        他の key は待たない。同じ token を作っている thread があればそれを待つ。
+        """
+        while True:
+            with self._lock:
+                found, value = lookup()
+                if found:
+                    return value
+                event = self._pending.get(token)
+                owner = event is None
+                if owner:
+                    event = self._pending[token] = threading.Event()
+            if not owner:
+                # 作っている thread が失敗したら、こちらで作り直す
+                event.wait()
+                continue
+            try:
+                value = factory()
+                with self._lock:
+                    return insert(value)
+            finally:
+                with self._lock:
+                    del self._pending[token]
+                event.set()
+
+    def acquire(self, key, factory):
+        def lookup():
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            entry.refs += 1
+            entry.last_used = time.monotonic()
+            return True, entry.value
+
+        def insert(value):
+            entry = self._entries[key] = _Entry(value)
+            entry.refs += 1
+            return value
+        return self._build(("entry", key), lookup, insert, factory)
+
+    def release(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry.refs = max(0, entry.refs - 1)
+            entry.last_used = time.monotonic()
+        self.collect()
+
+    def derived(self, key, name, factory):
+        """key の dataset から作ったもの。entry と一緒に捨てられる"""
+        def lookup():
+            derived = self._entries[key].derived
+            return name in derived, derived.get(name)
+
+        def insert(value):
+            entry = self._entries.get(key)
+            if entry is None:
+                # 作っている間に捨てられた
+                return value
+            return entry.derived.setdefault(name, value)
+        return self._build(("derived", key, name), lookup, insert, factory)
+
+    def shared(self, name, factory):
+        def lookup():
+            return name in self._shared, self._shared.get(name)
+
+        def insert(value):
+            return self._shared.setdefault(name, value)
+        return self._build(("shared", name), lookup, insert, factory)
+
+    def collect(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            expired = [k for k, e in self._entries.items()
+                       if e.refs == 0 and
+                       now - e.last_used >= self._idle_timeout]
+            for k in expired:
+                del self._entries[k]
+            if not self._entries:
+                self._shared.clear()
+        return expired
+
+    def stats(self):
+        with self._lock:
+            return [{"key": k, "refs": e.refs, "derived": len(e.derived)}
+                    for k, e in self._entries.items()]
+
+
+STORE = DatasetStore()
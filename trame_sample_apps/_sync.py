@@ -0,0 +1,324 @@
+#
+import time
+import json
+import asyncio
+import hashlib
+from collections import deque
+
+import msgpack
+from wslink.websocket import LinkProtocol
+from trame.app import asynchronous
+
+from ._transport import TRANSPORT_INFO
+
+# client が持っているものを外すときの呼び出し
+REMOVE_CALLS = {
+    "addViewProp": "removeViewProp",
+    "addLight": "removeLight",
+    "addRenderer": "removeRenderer",
+}
+
+JS_ARRAY_BYTES = {
+    "Int8Array": 1, "Uint8Array": 1,
+    "Int16Array": 2, "Uint16Array": 2,
+    "Int32Array": 4, "Uint32Array": 4,
+    "Float32Array": 4, "Float64Array": 8,
+}
+
+
+def _hash(obj):
+    data = json.dumps(obj, sort_keys=True, default=str).encode()
+    return hashlib.sha1(data).hexdigest()
+
+
+def _adds(node):
+    return {json.dumps(c) for c in node.get("calls", ())
+            if c[0] in REMOVE_CALLS}
+
+
+def _target(call):
+    """["addViewProp", ["instance:${123}"]] -> "123"""
+    return call[1][0][len("instance:${"):-1]
+
+
+def _arrays(node):
+    """node が参照している配列 {hash: byte 数}"""
+    result = {}
+    for value in node.get("properties", {}).values():
+        for a in (value if isinstance(value, list) else [value]):
+            if isinstance(a, dict) and "hash" in a:
+                result[a["hash"]] = a.get("size", 0) * \
+                    JS_ARRAY_BYTES.get(a.get("dataType"), 4)
+    return result
+
+
+class SceneIndex:
+    """
+    scene (render window を serialize したもの) を object ごとに分けて
+    hash をつけたもの。
+    """
+
+    def __init__(self, scene):
+        self.scene = scene
+        self.nodes = {}  # id -> (node の hash, 子を含めた hash)
+        self.adds = {}  # id -> add 系の呼び出し
+        self.arrays = {}  # 配列の hash -> byte 数
+        self.tree_arrays = {}  # id -> 子を含めて使う配列の hash
+        self._walk(scene)
+
+    def _walk(self, node):
+        own = {k: v for k, v in node.items() if k != "dependencies"}
+        node_hash = _hash(own)
+        arrays = _arrays(node)
+        self.arrays.update(arrays)
+        used = set(arrays)
+        children = []
+        for c in node.get("dependencies", ()):
+            children.append(self._walk(c))
+            used |= self.tree_arrays[c["id"]]
+        tree_hash = _hash([node_hash] + children)
+        self.nodes[node["id"]] = (node_hash, tree_hash)
+        self.adds[node["id"]] = _adds(node)
+        self.tree_arrays[node["id"]] = used
+        return tree_hash
+
+
+class Chunk:
+    """
+    1 回に送る delta と、送ったあとに ClientRecord に足すもの。
+    budget (byte) を超える新しい prop は deferred にして次の chunk に回す。
+    """
+    __slots__ = ("budget", "used", "arrays", "nodes", "adds", "deferred")
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.used = 0  # この chunk で新しく送る配列の byte 数
+        self.arrays = set()
+        self.nodes = {}
+        self.adds = {}
+        self.deferred = 0  # 次に回した prop の数
+
+    def fits(self, index, node_id, known):
+        """node_id の prop をこの chunk に入れるか (入れるなら配列を数える)"""
+        new = index.tree_arrays[node_id] - known - self.arrays
+        size = sum(index.arrays[h] for h in new)
+        if self.budget is not None and self.used and \
+                self.used + size > self.budget:
+            return False
+        self.used += size
+        self.arrays |= new
+        return True
+
+
+class ClientRecord:
+    """client が持っている object と配列 (hash で覚える)"""
+    __slots__ = ("nodes", "adds", "arrays", "sent", "pending", "connected")
+
+    def __init__(self):
+        self.nodes = {}
+        self.adds = {}
+        self.arrays = set()
+        self.sent = 0
+        self.pending = 0  # 次の chunk に回した prop の数
+        self.connected = time.time()
+
+    def delta(self, index, chunk=None, node=None):
+        """
+        index のうち、この client が持っていないところだけの scene。
+        変わっていない子は省き、変わった子までの途中は中身なしで残す。
+        chunk に budget があれば、新しい prop は配列の byte 数が budget に
+        収まる分だけ入れる (残りは chunk.deferred に数える)。
+        """
+        if chunk is None:
+            chunk = Chunk()
+        if node is None:
+            node = index.scene
+        node_id = node["id"]
+        node_hash, tree_hash = index.nodes[node_id]
+        old = self.nodes.get(node_id)
+        if old is not None and old[1] == tree_hash and node is not index.scene:
+            return None
+
+        # まだ client にない prop で、この chunk に入らないもの
+        skip = set()
+        for call in node.get("calls", ()):
+            if call[0] == "addViewProp" and json.dumps(call) not in \
+                    self.adds.get(node_id, set()):
+                target = _target(call)
+                if target in index.nodes and target not in self.nodes and \
+                        not chunk.fits(index, target, self.arrays):
+                    skip.add(target)
+        chunk.deferred += len(skip)
+
+        full = node is index.scene or old is None or old[0] != node_hash
+        if full:
+            chunk.arrays |= set(_arrays(node))
+            result = {k: v for k, v in node.items() if k != "dependencies"}
+            calls = [c for c in node.get("calls", ())
+                     if c[0] not in REMOVE_CALLS or _target(c) not in skip]
+            removed = self.adds.get(node_id, set()) - index.adds[node_id]
+            calls += [[REMOVE_CALLS[c[0]], c[1]]
+                      for c in map(json.loads, sorted(removed))]
+            if calls or "calls" in node:
+                result["calls"] = calls
+        else:
+            result = {k: node[k] for k in ("parent", "id", "type")
+                      if k in node}
+            result["properties"] = {}
+        deferred = chunk.deferred
+        deps = [d for d in (self.delta(index, chunk, c)
+                            for c in node.get("dependencies", ())
+                            if c["id"] not in skip)
+                if d is not None]
+        if deps:
+            result["dependencies"] = deps
+
+        # 一部を次に回したときは、次の chunk でまた見るように hash を残さない
+        complete = not skip and chunk.deferred == deferred
+        if full:
+            chunk.adds[node_id] = {
+                a for a in index.adds[node_id]
+                if _target(json.loads(a)) not in skip}
+            chunk.nodes[node_id] = (node_hash if not skip else None,
+                                    tree_hash if complete else None)
+        elif complete:
+            chunk.nodes[node_id] = (node_hash, tree_hash)
+        else:
+            chunk.nodes[node_id] = (node_hash, None)
+        return result
+
+    def update(self, index, chunk=None):
+        """
+        delta を送ったあとに呼ぶ。新しく送る配列の byte 数を返す。
+        chunk がなければ index を全部送ったことにする。
+        """
+        if chunk is None:
+            self.nodes.update(index.nodes)
+            self.adds.update(index.adds)
+            new = set(index.arrays) - self.arrays
+        else:
+            self.nodes.update(chunk.nodes)
+            self.adds.update(chunk.adds)
+            new = chunk.arrays - self.arrays
+        self.arrays |= new
+        return sum(index.arrays[h] for h in new)
+
+
+class SceneSync(LinkProtocol):
+    """
+    client ごとに、送った scene の object と配列を hash で覚えておいて、
+    update() では変わったものだけをその client に送る。
+    新しい prop の配列が chunk_bytes を超えるときは何回かに分けて送るので、
+    client では届いたものから表示される。
+    1 回の update で送った byte 数 (scene + client が取りに来る配列) は
+    last_bytes と history に残す。
+    """
+
+    def __init__(self, helper, view, scene_id, history=100, chunk_bytes=None):
+        super().__init__()
+        self._helper = helper
+        self._view = view
+        self._scene_id = scene_id
+        self._clients = {}  # client id -> ClientRecord
+        self._server = None
+        self._kwargs = {}  # widgets, orientation_axis
+        self._index = None  # 最後に serialize した scene
+        self._stream_task = None
+        if chunk_bytes is None:
+            chunk_bytes = TRANSPORT_INFO["chunk_bytes"]
+        self.chunk_bytes = chunk_bytes
+        self.last_bytes = 0
+        self.history = deque(maxlen=history)  # (時刻, object 数, byte 数)
+
+    @property
+    def clients(self):
+        return dict(self._clients)
+
+    @property
+    def streaming(self):
+        return self._stream_task is not None
+
+    def attach(self, server):
+        self._server = server
+        server.add_protocol_to_configure(
+            lambda protocol: protocol.registerLinkProtocol(self))
+
+    def onConnect(self, request, client_id):
+        # 新しい client は state の scene から始まるので、今のものにしておく
+        # (最初の chunk だけ。残りは view ができてから送る)
+        record = ClientRecord()
+        self._clients[client_id] = record
+        if self._server is not None and self._server.protocol:
+            self._index = SceneIndex(self._scene(True, **self._kwargs))
+            chunk = Chunk(self.chunk_bytes)
+            scene = record.delta(self._index, chunk)
+            self._server.state[self._scene_id] = scene
+            record.sent = len(msgpack.packb(scene)) + \
+                record.update(self._index, chunk)
+            record.pending = chunk.deferred
+
+    def onClose(self, client_id):
+        self._clients.pop(client_id, None)
+
+    def _scene(self, new_state, **kwargs):
+        return self._helper.scene(self._view, new_state=new_state, **kwargs)
+
+    def reset(self):
+        """全部送り直す (view が client 側で作り直されたときなど)"""
+        for record in self._clients.values():
+            record.nodes = {}
+            record.adds = {}
+
+    def _send(self, client_id, record):
+        """(byte 数, object 数)"""
+        chunk = Chunk(self.chunk_bytes)
+        delta = record.delta(self._index, chunk)
+        size = len(msgpack.packb(delta))
+        self.publish("trame.vtk.delta", delta, client_id=client_id)
+        size += record.update(self._index, chunk)
+        record.sent += size
+        record.pending = chunk.deferred
+        return size, _count(delta)
+
+    def update(self, widgets=None, orientation_axis=0):
+        self._kwargs = {"widgets": widgets,
+                        "orientation_axis": orientation_axis}
+        if self._server is None or not self._server.protocol:
+            return 0
+        self._index = SceneIndex(self._scene(True, **self._kwargs))
+        total = objects = 0
+        for client_id, record in list(self._clients.items()):
+            size, count = self._send(client_id, record)
+            total += size
+            objects += count
+        self.last_bytes = total
+        self.history.append((time.time(), objects, total))
+        if self._stream_task is None and \
+                any(r.pending for r in self._clients.values()):
+            self._stream_task = asynchronous.create_task(self._stream())
+        return total
+
+    async def _stream(self):
+        """chunk に入らなかった prop を、client が取りに来たら次を送る"""
+        try:
+            while True:
+                await asyncio.sleep(TRANSPORT_INFO["chunk_interval"])
+                # 前の chunk の配列を返し終わるまで待つ
+                if self._server.context.network_monitor is not None:
+                    await self._server.network_completion
+                pending = [(c, r) for c, r in list(self._clients.items())
+                           if r.pending]
+                if not pending:
+                    break
+                total = objects = 0
+                for client_id, record in pending:
+                    size, count = self._send(client_id, record)
+                    total += size
+                    objects += count
+                self.history.append((time.time(), objects, total))
+        finally:
+            self._stream_task = None
+
+
+def _count(node):
+    return 1 + sum(_count(c) for c in node.get("dependencies", ()))
@@ -0,0 +1,87 @@
+#
+import time
+import zlib
+
+from vtkmodules.vtkCommonDataModel import vtkDataSet
+
+TRANSPORT_INFO = {
+    "chunk_bytes": 4 << 20,  # 1 回の delta で新しく送る配列の byte 数の目安
+    "chunk_interval": 0.02,  # chunk の間に client が配列を取りに来るのを待つ
+    "bandwidth": 12.5e6,  # 想定する回線 (byte/s, 100 Mbps)
+    "sample_bytes": 1 << 20,  # 圧縮を測るのに使う byte 数
+    "deflate_level": 1,  # aiohttp が websocket の deflate に使う level
+}
+
+
+def geometry_buffers(renderer):
+    """renderer の actor が表示している点、cell、配列の buffer (重複なし)"""
+    buffers = {}
+    props = renderer.GetViewProps()
+    for i in range(props.GetNumberOfItems()):
+        prop = props.GetItemAsObject(i)
+        mapper = prop.GetMapper() if hasattr(prop, "GetMapper") else None
+        ds = mapper.GetInput() if mapper is not None else None
+        if not isinstance(ds, vtkDataSet):
+            continue
+        arrays = []
+        if hasattr(ds, "GetPoints") and ds.GetPoints() is not None:
+            arrays.append(ds.GetPoints().GetData())
+        for name in ("GetPolys", "GetLines", "GetStrips", "GetVerts"):
+            cells = getattr(ds, name, None)
+            if cells is not None:
+                arrays.append(cells().GetConnectivityArray())
+        for data in (ds.GetPointData(), ds.GetCellData()):
+            arrays += [data.GetArray(j)
+                       for j in range(data.GetNumberOfArrays())]
+        for a in arrays:
+            if a is not None and a.GetNumberOfTuples() > 0:
+                buffers[a.GetAddressAsString("")] = memoryview(a)
+    return list(buffers.values())
+
+
+def measure_deflate(buffers, level=None, sample_bytes=None):
+    """
+    buffers の先頭から sample_bytes ずつ取って deflate したときの
+    {"ratio", "compress", "decompress"} (速さは byte/s)。
+    """
+    if level is None:
+        level = TRANSPORT_INFO["deflate_level"]
+    if sample_bytes is None:
+        sample_bytes = TRANSPORT_INFO["sample_bytes"]
+    per_buffer = max(sample_bytes // max(len(buffers), 1), 4096)
+    sample = b"".join(b.cast("B")[:per_buffer].tobytes() for b in buffers)
+    if not sample:
+        return None
+
+    t = time.perf_counter()
+    packed = zlib.compress(sample, level)
+    t_compress = max(time.perf_counter() - t, 1e-9)
+    t = time.perf_counter()
+    zlib.decompress(packed)
+    t_decompress = max(time.perf_counter() - t, 1e-9)
+    return {
+        "ratio": len(sample) / max(len(packed), 1),
+        "compress": len(sample) / t_compress,
+        "decompress": len(sample) / t_decompress,
+    }
+
+
+def deflate_pays_off(stats, bandwidth=None):
+    """圧縮してから送るほうが 1 byte あたり速く届くか"""
+    if stats is None:
+        return False
+    if bandwidth is None:
+        bandwidth = TRANSPORT_INFO["bandwidth"]
+    raw = 1 / bandwidth
+    packed = 1 / stats["compress"] + 1 / (stats["ratio"] * bandwidth) + \
+        1 / stats["decompress"]
+    return packed < raw
+
+
+def use_deflate(level, buffers=()):
+    """
+    level 0: 使わない、正: 使う、負: buffers を測って速くなるなら使う。
+    """
+    if level >= 0:
+        return level > 0
+    return deflate_pays_off(measure_deflate(list(buffers)))
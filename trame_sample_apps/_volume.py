@@ -0,0 +1,162 @@
+#
+import threading
+
+import numpy as np
+
+from vtkmodules.util.numpy_support import vtk_to_numpy, numpy_to_vtk
+from vtkmodules.vtkCommonDataModel import (
+    vtkCellLocatorStrategy,
+    vtkDataObject,
+    vtkImageData,
+    vtkPiecewiseFunction,
+    vtkPointSet,
+    vtkStaticCellLocator,
+)
+from vtkmodules.vtkFiltersCore import vtkProbeFilter
+from vtkmodules.vtkRenderingCore import vtkColorTransferFunction
+
+VOLUME_INFO = {
+    "resolutions": [32, 64, 128, 256],
+    "resolution": 128,
+    "interactive_resolution": 32,  # 動かしている間に見せる解像度
+    "opacity": (0.02, 0.6),  # range の min, max での不透明度
+}
+
+
+def image_grid(bounds, resolution):
+    """一番長い辺を resolution 点にした (dims, origin, spacing)"""
+    size = [bounds[i * 2 + 1] - bounds[i * 2] for i in range(3)]
+    longest = max(max(size), 1e-12)
+    dims = [max(2, int(round((resolution - 1) * s / longest)) + 1)
+            for s in size]
+    spacing = [s / (d - 1) if s > 0 else 1.0 for s, d in zip(size, dims)]
+    return dims, [bounds[0], bounds[2], bounds[4]], spacing
+
+
+class VolumeResampler:
+    """
+    dataset (composite なら各 block) を vtkImageData に resample する。
+
+    cell locator は block ごとに 1 回だけ作り、配列や解像度が変わっても
+    使い回す。結果は (配列名, association, 解像度) ごとに cache する。
+    resample() は worker thread で呼ばれる。
+    """
+
+    def __init__(self, blocks, bounds):
+        self._blocks = list(blocks)
+        self._bounds = tuple(bounds)
+        self._locators = {}  # block 番号 -> vtkStaticCellLocator
+        self._cache = {}  # (name, association, resolution) -> (image, fill)
+        self._lock = threading.Lock()
+
+    def cached(self, name, association, resolution):
+        return self._cache.get((name, association, resolution))
+
+    def _locator(self, i, ds):
+        if not isinstance(ds, vtkPointSet):
+            # image などは自分で cell を探せる
+            return None
+        locator = self._locators.get(i)
+        if locator is None:
+            locator = vtkStaticCellLocator()
+            locator.SetDataSet(ds)
+            locator.BuildLocator()
+            self._locators[i] = locator
+        return locator
+
+    def _probe(self, i, ds, array, association, grid):
+        # 選んだ配列だけ持った source にして、他の配列は補間しない
+        source = ds.NewInstance()
+        source.CopyStructure(ds)
+        if association == vtkDataObject.FIELD_ASSOCIATION_POINTS:
+            source.GetPointData().AddArray(array)
+        else:
+            source.GetCellData().AddArray(array)
+
+        dims, origin, spacing = grid
+        image = vtkImageData()
+        image.SetDimensions(dims)
+        image.SetOrigin(origin)
+        image.SetSpacing(spacing)
+
+        probe = vtkProbeFilter()
+        probe.SetInputData(image)
+        probe.SetSourceData(source)
+        locator = self._locator(i, ds)
+        if locator is not None:
+            strategy = vtkCellLocatorStrategy()
+            strategy.SetCellLocator(locator)
+            probe.SetFindCellStrategy(strategy)
+        probe.Update()
+
+        pd = probe.GetOutput().GetPointData()
+        values = vtk_to_numpy(pd.GetArray(array.GetName()))
+        if values.ndim > 1:
+            # threshold と同じく component 0 を使う
+            values = values[:, 0]
+        valid = vtk_to_numpy(pd.GetArray(probe.GetValidPointMaskArrayName()))
+        return values, valid.astype(bool)
+
+    def resample(self, name, association, resolution):
+        """(vtkImageData, 外側の点の値)。配列がどこにもなければ None"""
+        key = (name, association, resolution)
+        with self._lock:
+            if key in self._cache:
+                return self._cache[key]
+
+            grid = image_grid(self._bounds, resolution)
+            dims = grid[0]
+            values = np.zeros(dims[0] * dims[1] * dims[2], dtype=np.float32)
+            mask = np.zeros(len(values), dtype=bool)
+            lo, hi = np.inf, -np.inf
+            for i, ds in enumerate(self._blocks):
+                if association == vtkDataObject.FIELD_ASSOCIATION_POINTS:
+                    array = ds.GetPointData().GetArray(name)
+                else:
+                    array = ds.GetCellData().GetArray(name)
+                if array is None:
+                    continue
+                r = array.GetRange(0)
+                lo, hi = min(lo, r[0]), max(hi, r[1])
+                v, valid = self._probe(i, ds, array, association, grid)
+                # block が重なるところは先の block を優先
+                valid &= ~mask
+                values[valid] = v[valid]
+                mask |= valid
+            if not mask.any():
+                return None
+
+            # data の外は配列の min より少し下にして、不透明度 0 で消す
+            # (解像度によらず同じ値になる)
+            fill = lo - 0.01 * ((hi - lo) or 1.0)
+            values[~mask] = fill
+
+            image = vtkImageData()
+            image.SetDimensions(dims)
+            image.SetOrigin(grid[1])
+            image.SetSpacing(grid[2])
+            array = numpy_to_vtk(values, deep=1)
+            array.SetName(name)
+            image.GetPointData().SetScalars(array)
+            self._cache[key] = (image, fill)
+            return self._cache[key]
+
+
+def transfer_functions(lut, scalar_range, fill, opacity=None):
+    """LUT と同じ色の (vtkColorTransferFunction, vtkPiecewiseFunction)"""
+    r0, r1 = scalar_range
+    if r1 <= r0:
+        r1 = r0 + 1.0
+    a0, a1 = opacity or VOLUME_INFO["opacity"]
+
+    ctf = vtkColorTransferFunction()
+    n = lut.GetNumberOfTableValues()
+    for i in range(n):
+        rgba = lut.GetTableValue(i)
+        ctf.AddRGBPoint(r0 + (r1 - r0) * i / max(n - 1, 1), *rgba[:3])
+
+    pwf = vtkPiecewiseFunction()
+    pwf.AddPoint(min(fill, r0 - 1e-6 * (r1 - r0)), 0.0)
+    pwf.AddPoint(r0, a0)
+    pwf.AddPoint(r1, a1)
+    return ctf, pwf
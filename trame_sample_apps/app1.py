@@ -1,7 +1,7 @@
 #
-from ._base import BaseViewer
+from ._base import BaseViewer, boundsPixelSize
+from ._lod import LOD_INFO, sphere_lod, earth_lod
 from trame.decorators import TrameApp
-from vtkmodules.vtkFiltersSources import vtkSphereSource
 from vtkmodules.vtkFiltersHybrid import vtkEarthSource
 from vtkmodules.vtkRenderingCore import (
     vtkPolyDataMapper,
@@ -12,34 +12,62 @@ from vtkmodules.vtkRenderingCore import (
 @TrameApp()
 class Viewer(BaseViewer):
     def generate_actors(self, renderer):
-        e = vtkEarthSource()
-        e.OutlineOn()
-        e.Update()
+        radius = vtkEarthSource().GetRadius()
+        # 分割数は画面での大きさで決める (update_level_of_detail)
+        self._lod_renderer = renderer
+        self._lod_radius = radius
+        self._lods = []  # [(actor, ProceduralLOD, 今の level)]
 
         e_mapper = vtkPolyDataMapper()
-        e_mapper.SetInputConnection(e.GetOutputPort())
 
         e_actor = vtkActor()
         e_actor.SetMapper(e_mapper)
         e_actor.GetProperty(). \
             SetColor(self._colors.GetColor3d("Black"))
 
-        s = vtkSphereSource()
-        s.SetThetaResolution(100)
-        s.SetPhiResolution(100)
-        s.SetRadius(e.GetRadius())
-
         s_mapper = vtkPolyDataMapper()
-        s_mapper.SetInputConnection(s.GetOutputPort())
 
         s_actor = vtkActor()
         s_actor.SetMapper(s_mapper)
         s_actor.GetProperty(). \
             SetColor(self._colors.GetColor3d("PeachPuff"))
 
+        self._lods = [[e_actor, earth_lod(radius), None],
+                      [s_actor, sphere_lod(radius), None]]
+        # camera はまだないので、一番粗いもので始める
+        for item in self._lods:
+            actor, lod, _ = item
+            item[2] = lod.levels[0]
+            actor.GetMapper().SetInputData(lod.get(item[2]))
+
         return e_actor, s_actor
         # renderer.RemoveAllLights()
 
+    def _vtk_setup(self):
+        rw = super()._vtk_setup()
+        self.update_level_of_detail()
+        return rw
+
+    def update_level_of_detail(self):
+        r = self._lod_radius
+        bounds = (-r, r, -r, r, -r, r)
+        diag = 2 * r * 3 ** 0.5
+        camera = self._lod_renderer.GetActiveCamera()
+        height = self.view_height(LOD_INFO["view_height"])
+        pixels_per_unit = boundsPixelSize(camera, height, bounds) / diag
+
+        for item in self._lods:
+            actor, lod, level = item
+            new_level = lod.choose(pixels_per_unit)
+            if new_level == level:
+                continue
+            item[2] = new_level
+            # level ごとの polydata は cache されている
+            actor.GetMapper().SetInputData(lod.get(new_level))
+            if self.debug:
+                print('lod:', level, '->', new_level,
+                      'cells', actor.GetMapper().GetInput().GetNumberOfCells())
+
 
 def main(**kwargs):
     viewer = Viewer()
@@ -1,20 +1,40 @@
 #
 import os
 import sys
+import time
+import asyncio
 import argparse
 from pathlib import Path
 
+import numpy as np
+
 from ._base import BaseViewer
+from ._progressive import ProgressiveLoader
+from ._pipeline import FilterPipeline
+from ._store import STORE
+from ._axes import AXES_MODES, outline_polydata
+from ._volume import VOLUME_INFO, VolumeResampler, transfer_functions
+from ._index import FileIndex, dataset_arrays
+from ._catalog import CATALOG_INFO, ArrayCatalog
+from ._transport import geometry_buffers, measure_deflate, use_deflate
+from ._bvh import BVH_INFO, BVH
+from ._compare import (
+    leaves, dedupe, shares_topology, share_surface, difference,
+)
+from trame.app import asynchronous
 from trame.decorators import TrameApp, change
 from trame.widgets import vuetify
 from vtkmodules.vtkCommonCore import (
+    reference,
     vtkLookupTable,
-    vtkUnsignedCharArray,
 )
+from vtkmodules.util import numpy_support
 from vtkmodules.vtkRenderingCore import (  # noqa
+    vtkRenderer,
     vtkDataSetMapper,
     vtkPolyDataMapper,
     vtkActor,
+    vtkVolume,
 )
 from vtkmodules.vtkIOLegacy import (  # noqa
     vtkUnstructuredGridReader,
@@ -33,11 +53,14 @@ from vtkmodules.vtkIOXML import (  # noqa
 from vtkmodules.vtkIOPLY import vtkPLYReader
 from vtkmodules.vtkIOGeometry import vtkOBJReader, vtkSTLReader, vtkBYUReader
 from vtkmodules.vtkCommonDataModel import (  # noqa
+    vtkCellLocator,
     vtkDataSet,
+    vtkPolyData,
     vtkCompositeDataSet,
     vtkDataObjectTreeIterator,
     vtkDataObject,
 )
+from vtkmodules.vtkFiltersGeometry import vtkDataSetSurfaceFilter
 from vtkmodules.vtkRenderingAnnotation import (  # noqa
     vtkAxesActor,
     vtkCubeAxesActor2D,
@@ -65,17 +88,90 @@ READERCLASS = {
 
 @TrameApp()
 class Viewer(BaseViewer):
-    def __init__(self, filename, **kwargs):
+    def __init__(self, filename, progressive=False, pieces=8,
+                 memory_limit=1024, store=None, idle_timeout=0,
+                 axes="cube", compare=False, index=None,
+                 volume_resolution=VOLUME_INFO["resolution"], cull=False,
+                 cull_pixels=BVH_INFO["min_pixels"], **kwargs):
         self._vtk_filename = filename[0] if len(filename) > 0 else None
-        self._dataset_arrays = []
+        # compare mode: 2 つ目以降のファイルを横に並べる (camera は共通)
+        self._compare_files = list(filename[1:]) if compare else []
+        self._compare_renderers = []
+        self._compare_keys = []
+        self._compare_refs = {}  # actor -> (元の actor, store key, block 番号)
+        self._index = FileIndex(index) if index else None
+        self._open_task = None
+        self._catalog = ArrayCatalog()  # 配列の一覧
+        self._block_of = {}  # actor -> catalog の block 番号
         self._draw_actors = []
         self._axes_actor = None
         self._scalarbar_actor = None
+        self._progressive = progressive
+        self._pieces = pieces
+        self._memory_limit = memory_limit
+        self._loader = None
+        self._loader_task = None
+        self._piece_actors = {}
+        self._preview_actor = None
+        self._data_bounds = None
+        self._filters = {}
+        self._filter_task = None
+        self._filter_generation = 0
+        self._store = store if store is not None else STORE
+        self._store_key = None
+        self._actor_sources = {}
+        self._display_inputs = {}  # actor -> filter をかける前の表示用データ
+        self._session_copies = {}  # store のデータ -> この session 用の copy
+        self._materials = {}  # block 名 -> actors
+        self._material_props = {}  # block 名 -> 表示設定 (reload 後も使う)
+        self._volume_actor = None
+        self._volume_images = {}  # "low"/"full" -> (image, 外側の値)
+        self._volume_task = None
+        self._volume_generation = 0
+        self._interacting = False
+        # block の bounds の BVH (culling と pick に使う)
+        self._cull = cull
+        self._cull_pixels = cull_pixels
+        self._bvh = None
+        self._bvh_actors = []  # BVH の block 番号順の actor
+        self._bvh_index = {}  # actor -> block 番号
+        self._culled = set()  # culling で消している actor
+        self._pick_locators = {}  # actor -> (入力, vtkCellLocator)
+        self._idle_timeout = idle_timeout
+        self._last_active = time.monotonic()
+        self._suspended = False
         state_defaults = {"colormap_idx": 0,
                           "lookuptable_idx": 1,
                           "active_ui": None,
+                          "filter_threshold": False,
+                          "filter_threshold_range": [0, 100],
+                          "filter_clip": False,
+                          "filter_clip_axis": 0,
+                          "filter_clip_pos": 50,
+                          "filter_slice": False,
+                          "filter_slice_axis": 2,
+                          "filter_slice_pos": 50,
+                          "axes_mode": axes,
+                          "material_list": [],
+                          "compare_mode": len(self._compare_files) > 0,
+                          "browser_enabled": self._index is not None,
+                          "browser_open": False,
+                          "browser_query": "",
+                          "browser_items": [],
+                          "browser_total": 0,
+                          "browser_loading": False,
+                          "volume_enabled": False,
+                          "volume_mode": False,
+                          "volume_resolution": volume_resolution,
+                          "volume_loading": False,
+                          "colormap_list": [],
+                          "colormap_query": "",
+                          "colormap_total": 0,
+                          "pick_info": "",
+                          "culled_blocks": 0,
                           }
         super().__init__(state_defaults=state_defaults, **kwargs)
+        self._view.set_orientation_axis(axes == "widget")
         # self._server.state.setdefault("colormap_idx", 0)
         # self._server.state.setdefault("lookuptable_idx", 1)
         # self._server.state.setdefault("active_ui", None)
@@ -90,6 +186,7 @@ class Viewer(BaseViewer):
             return ()
 
         self._draw_actors = []
+        self._materials = {}
         mat2color = {
             "si":     self._colors.GetColor3d('Red'),
             "polysi": self._colors.GetColor3d('Blue'),
@@ -108,18 +205,21 @@ class Viewer(BaseViewer):
         if readercls is None:
             raise RuntimeError('Not found class for reading.')
 
-        reader = readercls()
-        # reader.DebugOn()  # 使えないらしい
-        reader.SetFileName(self._vtk_filename)
-        reader.Update()
-        if reader.GetErrorCode() != 0:
-            raise RuntimeError('Cannot open: ' + self._vtk_filename)
-
-        data_obj = reader.GetOutput()
+        if self._progressive and ProgressiveLoader.supports(readercls):
+            # piece 0 を間引いたものをまず表示、残りは on_ready 後に読む
+            self._loader = ProgressiveLoader(
+                readercls, self._vtk_filename,
+                num_pieces=self._pieces,
+                memory_limit=self._memory_limit,
+                debug=self.debug)
+            data_obj = self._loader.preview()
+        else:
+            # 同じファイルは session 間で共有する
+            self._store_key = self._store.file_key(self._vtk_filename)
+            data_obj = self._store.acquire(
+                self._store_key, lambda: self._read_file(readercls))
         if self.debug:
             print('date type is', type(data_obj))
-        if data_obj is not None:
-            data_obj.Register(reader)
         ds = vtkDataSet.SafeDownCast(data_obj)
         dc = vtkCompositeDataSet.SafeDownCast(data_obj)
         if self.debug:
@@ -132,30 +232,6 @@ class Viewer(BaseViewer):
             print("  number of cells:", ds.GetNumberOfCells())
             print("  number of points:", ds.GetNumberOfPoints())
 
-            fields = [
-                (ds.GetPointData(), vtkDataObject.FIELD_ASSOCIATION_POINTS),
-                (ds.GetCellData(), vtkDataObject.FIELD_ASSOCIATION_CELLS),
-            ]
-            dataset_arrays = []
-            for field in fields:
-                field_arrays, association = field
-                for i in range(field_arrays.GetNumberOfArrays()):
-                    array = field_arrays.GetArray(i)
-                    # print('array', array)
-                    uc = vtkUnsignedCharArray.SafeDownCast(array)
-                    # print('uc', uc)
-                    dataset_arrays.append(
-                        {"text": array.GetName(),
-                         "variable_name": array.GetName(),
-                         "value": i,
-                         "range": list(array.GetRange()),
-                         "type": association,
-                         "u_char": uc is not None,
-                         }
-                    )
-            # pprint(dataset_arrays)
-            self._dataset_arrays = dataset_arrays
-
             # mapper = vtkPolyDataMapper()
             # vtkDataSetMapper は vtkDataSetSurfaceFilter + vtkPolyDataMapper
             # のようなもの、かな？
@@ -163,7 +239,7 @@ class Viewer(BaseViewer):
             mapper = vtkDataSetMapper()
             # mapper.DebugOn()  # こっちも使えないみたい
             # mapper.SetInputConnection(reader.GetOutputPort())
-            mapper.SetInputData(ds)
+            mapper.SetInputData(self._surface(ds, 0))
 
             lut = mapper.GetLookupTable()
             # print(lut)
@@ -201,6 +277,10 @@ class Viewer(BaseViewer):
                 print('   bounds:', bounds)
 
             self._draw_actors.append(actor)
+            self._actor_sources[actor] = ds
+            self._display_inputs[actor] = mapper.GetInput()
+            if self._loader is not None:
+                self._preview_actor = actor
 
         if dc is not None:
             print("  total of points:", dc.GetNumberOfPoints())
@@ -227,7 +307,7 @@ class Viewer(BaseViewer):
                     print("   number of points:", ds.GetNumberOfPoints())
 
                 mapper = vtkDataSetMapper()
-                mapper.SetInputData(ds)
+                mapper.SetInputData(self._surface(ds, len(self._draw_actors)))
 
                 actor = vtkActor()
                 actor.SetMapper(mapper)
@@ -248,24 +328,27 @@ class Viewer(BaseViewer):
                         lambda f, x, y: f(x, y), compf, bounds, b))
 
                 self._draw_actors.append(actor)
+                self._actor_sources[actor] = ds
+                self._display_inputs[actor] = mapper.GetInput()
+                self._materials.setdefault(name, []).append(actor)
 
                 iter.GoToNextItem()
 
+            for name in self._materials:
+                self._material_props.setdefault(
+                    name, {"visible": True, "opacity": 1.0})
+                self._apply_material(name)
+
             if self.debug:
                 print(' bounds:', bounds)
 
-        self._dataset_arrays.append(
-            {"text": '<solid>',
-             "variable_name": '<solid>',
-             "value": len(self._dataset_arrays),
-             "range": [0, 255],
-             "type": -1,
-             "u_char": False,
-             }
-        )
-        for i, arr in enumerate(self._dataset_arrays):
-            self._dataset_arrays[i]["value"] = int(i)
-        # pprint(self._dataset_arrays)
+        # composite なら全 block の配列 (block ごとの range もまとめる)
+        self._catalog = ArrayCatalog.from_blocks(
+            [self._actor_sources[a] for a in self._draw_actors])
+        self._block_of = {a: i for i, a in enumerate(self._draw_actors)}
+        if self.debug:
+            print(' arrays:', len(self._catalog) - 1,
+                  'in', self._catalog.num_blocks, 'blocks')
 
         """
         axes = vtkAxesActor()
@@ -290,9 +373,221 @@ class Viewer(BaseViewer):
             SetColor(self._colors.GetColor3d('Red'))
         """
 
+        self.server.state.material_list = self._material_list()
+        self._publish_catalog()
+        # volume は読み込んだデータ全体から作る (progressive, compare 以外)
+        self.server.state.volume_enabled = \
+            self._loader is None and not self._compare_files
+
+        self._data_bounds = bounds
+        self._index_blocks()
+        self._axes_actor = self._create_axes(self.server.state.axes_mode,
+                                             renderer)
+        if self._axes_actor is None:
+            return self._draw_actors
+        return *self._draw_actors, self._axes_actor
+
+    def _material_list(self):
+        return [{"name": name,
+                 "blocks": len(actors),
+                 **self._material_props[name]}
+                for name, actors in self._materials.items()]
+
+    def _apply_material(self, name):
+        props = self._material_props[name]
+        for actor in self._materials.get(name, ()):
+            actor.SetVisibility(props["visible"] and actor not in self._culled)
+            actor.GetProperty().SetOpacity(props["opacity"])
+            i = self._bvh_index.get(actor)
+            if i is not None:
+                self._bvh.set_active([i], props["visible"])
+
+    def _index_blocks(self):
+        """
+        block の bounds の BVH を作る。block の数が同じ (読み直し) なら
+        作り直さずに、bounds が変わった block の箱だけ直す。
+        """
+        self._culled = set()
+        self._pick_locators = {}
+        if self._loader is not None:
+            # progressive は piece ごとに別に管理している
+            self._bvh, self._bvh_actors, self._bvh_index = None, [], {}
+            return
+        actors = list(self._draw_actors)
+        bounds = [a.GetBounds() for a in actors]
+        if self._bvh is not None and len(self._bvh) == len(actors):
+            for i, b in enumerate(bounds):
+                self._bvh.update(i, b)
+        else:
+            self._bvh = BVH(bounds)
+        self._bvh_actors = actors
+        self._bvh_index = {a: i for i, a in enumerate(actors)}
+        self._bvh.set_active(range(len(actors)), True)
+        self._bvh.set_active(
+            [i for i, a in enumerate(actors) if not a.GetVisibility()], False)
+
+    def _viewport(self, renderer):
+        """renderer の (幅, 高さ) (pixel)"""
+        w, h = self._view_size or self._vtk_rw.GetSize()
+        vp = renderer.GetViewport()
+        return w * (vp[2] - vp[0]), h * (vp[3] - vp[1])
+
+    def update_level_of_detail(self):
+        super().update_level_of_detail()
+        self._apply_culling()
+
+    def _apply_culling(self):
+        """視野の外と、画面で小さすぎる block を描かない"""
+        if not self._cull or self._bvh is None or not self._bvh_actors:
+            return
+        renderer = self.renderer
+        w, h = self._viewport(renderer)
+        shown = self._bvh.visible(renderer.GetActiveCamera(), w / max(h, 1),
+                                  h, self._cull_pixels)
+        shown = {self._bvh_actors[i] for i in shown.tolist()}
+        culled = {a for a in self._bvh_actors
+                  if a not in shown and a.GetVisibility()} | \
+            (self._culled - shown)
+        # compare の actor は最初のファイルの同じ block にあわせる
+        culled |= {a for a, (ref, _, _) in self._compare_refs.items()
+                   if ref in culled}
+        if culled == self._culled:
+            return
+        changed = culled ^ self._culled
+        self._culled = culled
+        hidden = {a for name, props in self._material_props.items()
+                  if not props["visible"]
+                  for a in self._materials.get(name, ())}
+        for a in changed:
+            a.SetVisibility(a not in culled and a not in hidden)
+        self.server.state.culled_blocks = len(
+            [a for a in culled if a in self._bvh_index])
+        if self.debug:
+            print('cull:', len(shown), 'shown,',
+                  self.server.state.culled_blocks, 'culled')
+
+    def pick(self, x, y):
+        """
+        view の (x, y) (pixel、左下から) にある block。
+        BVH で線と箱が交わる block だけ調べる。
+        (actor, cell 番号, 位置) か None
+        """
+        if self._bvh is None or not self._bvh_actors:
+            return None
+        renderer = self.renderer
+        vw, vh = self._view_size or self._vtk_rw.GetSize()
+        w, h = self._viewport(renderer)
+        vp = renderer.GetViewport()
+        ndc = np.array([(x - vp[0] * vw) / max(w, 1) * 2 - 1,
+                        (y - vp[1] * vh) / max(h, 1) * 2 - 1])
+        camera = renderer.GetActiveCamera()
+        m = camera.GetCompositeProjectionTransformMatrix(w / max(h, 1), -1, 1)
+        inv = np.linalg.inv(np.array(
+            [[m.GetElement(i, j) for j in range(4)] for i in range(4)]))
+
+        def unproject(z):
+            p = inv @ np.array([ndc[0], ndc[1], z, 1.0])
+            return p[:3] / p[3]
+        p0 = unproject(-1.0)
+        direction = unproject(1.0) - p0
+        direction /= max(np.linalg.norm(direction), 1e-30)
+        # clipping range が古くてもデータ全体を通るようにのばす
+        b = np.array(self._data_bounds, dtype=float)
+        length = np.linalg.norm(b[1::2] - b[0::2]) + \
+            np.linalg.norm((b[0::2] + b[1::2]) / 2 - p0)
+        if camera.GetParallelProjection():
+            p0 = p0 - direction * length
+        p1 = p0 + direction * length * 2
+
+        best = None
+        for i in self._bvh.ray(p0, p1).tolist():
+            actor = self._bvh_actors[i]
+            if not actor.GetVisibility():
+                continue
+            ds = actor.GetMapper().GetInput()
+            cached = self._pick_locators.get(actor)
+            if cached is None or cached[0] is not ds:
+                locator = vtkCellLocator()
+                locator.SetDataSet(ds)
+                locator.BuildLocator()
+                cached = self._pick_locators[actor] = (ds, locator)
+            t, sub_id, cell_id = reference(0.0), reference(0), reference(0)
+            x_hit, pcoords = [0.0] * 3, [0.0] * 3
+            if cached[1].IntersectWithLine(p0, p1, 0.0, t, x_hit, pcoords,
+                                           sub_id, cell_id):
+                if best is None or t.get() < best[0]:
+                    best = (t.get(), actor, cell_id.get(), tuple(x_hit))
+        return best[1:] if best is not None else None
+
+    def on_right_button_release(self, pickData):
+        position = (pickData or {}).get("position")
+        if not position:
+            return
+        hit = self.pick(position["x"], position["y"])
+        if hit is None:
+            self.server.state.pick_info = ""
+            return
+        actor, cell_id, x = hit
+        name = next((n for n, actors in self._materials.items()
+                     if actor in actors), "")
+        block = self._bvh_index[actor]
+        self.server.state.pick_info = \
+            f"{name or 'block'} #{block} cell {cell_id} " \
+            f"({x[0]:.4g}, {x[1]:.4g}, {x[2]:.4g})"
+
+    def set_materials(self, names=None, visible=None, opacity=None):
+        """
+        names の block の表示/不透明度を変える (None なら全部)。
+        actor の property を変えるだけなので、geometry は送り直さない。
+        何個変えても view の更新は 1 回。
+        """
+        if names is None:
+            names = list(self._materials)
+        for name in names:
+            props = self._material_props.get(name)
+            if props is None:
+                continue
+            if visible is not None:
+                props["visible"] = bool(visible)
+            if opacity is not None:
+                props["opacity"] = float(opacity)
+            self._apply_material(name)
+        self._apply_culling()
+        self.server.state.material_list = self._material_list()
+        self.server.controller.update_views()
+
+    def _create_axes(self, mode, renderer):
+        if mode == "cube":
+            return self._cube_axes(renderer)
+        if mode == "outline":
+            mapper = vtkPolyDataMapper()
+            mapper.SetInputData(self._outline(self._data_bounds))
+            actor = vtkActor()
+            actor.SetMapper(mapper)
+            actor.GetProperty().SetColor(self._colors.GetColor3d('Red'))
+            actor.PickableOff()
+            return actor
+        # "widget" は client 側の orientation axes だけ
+        return None
+
+    def _outline(self, bounds):
+        # bounds が同じなら全 session で 1 つ
+        return self._store.shared(("outline", tuple(bounds)),
+                                  lambda: outline_polydata(bounds))
+
+    def _update_axes_bounds(self):
+        axes = self._axes_actor
+        if axes is None:
+            return
+        if isinstance(axes, vtkCubeAxesActor):
+            axes.SetBounds(self._data_bounds)
+        else:
+            axes.GetMapper().SetInputData(self._outline(self._data_bounds))
+
+    def _cube_axes(self, renderer):
         axes = vtkCubeAxesActor()
         axes.SetUseTextActor3D(1)
-        axes.SetBounds(bounds)
+        axes.SetBounds(self._data_bounds)
         axes.SetAxisOrigin(-0.02, -0.02, 0.0)
         # axis.SetUseAxisOrigin(1)
 
@@ -350,9 +645,665 @@ class Viewer(BaseViewer):
         # print('Axes', axes)
 
         axes.SetCamera(renderer.GetActiveCamera())
-        self._axes_actor = axes
+        return axes
+
+    def _vtk_setup(self):
+        rw = super()._vtk_setup()
+        if self._compare_files and self._loader is None:
+            first = rw.GetRenderers().GetFirstRenderer()
+            n = len(self._compare_files) + 1
+            first.SetViewport(0, 0, 1 / n, 1)
+            for i in range(1, n):
+                renderer = vtkRenderer()
+                renderer.SetBackground(first.GetBackground())
+                renderer.SetViewport(i / n, 0, (i + 1) / n, 1)
+                # camera を共有すれば client 側でも連動する
+                renderer.SetActiveCamera(first.GetActiveCamera())
+                rw.AddRenderer(renderer)
+                self._compare_renderers.append(renderer)
+            self._load_compare()
+        return rw
+
+    def _load_compare(self):
+        refs = [(a, self._actor_sources[a]) for a in self._draw_actors]
+        ref_ds = [ds for _, ds in refs]
+        for renderer, filename in zip(self._compare_renderers,
+                                      self._compare_files):
+            readercls = READERCLASS.get(Path(filename).suffix.lower(), None)
+            if readercls is None:
+                raise RuntimeError('Not found class for reading.')
+
+            def read():
+                data_obj = self._read_file(readercls, filename)
+                # 同じ topology の block は点と cell を共有する
+                n = dedupe(data_obj, ref_ds)
+                if self.debug:
+                    print('compare:', filename, n, 'blocks share topology')
+                return data_obj
+            key = self._store.file_key(filename)
+            data_obj = self._store.acquire(key, read)
+            self._compare_keys.append(key)
+
+            for j, ((ref_actor, ref), (name, ds)) in enumerate(
+                    zip(refs, leaves(data_obj))):
+                mapper = vtkDataSetMapper()
+                mapper.SetInputData(self._compare_surface(key, j, ref, ds))
+                mapper.SetLookupTable(ref_actor.GetMapper().GetLookupTable())
+                actor = vtkActor()
+                actor.SetMapper(mapper)
+                actor.GetProperty().DeepCopy(ref_actor.GetProperty())
+                renderer.AddActor(actor)
 
-        return *self._draw_actors, axes
+                self._draw_actors.append(actor)
+                self._actor_sources[actor] = ds
+                self._display_inputs[actor] = mapper.GetInput()
+                self._compare_refs[actor] = (ref_actor, key, j)
+                if name in self._materials:
+                    self._materials[name].append(actor)
+                    self._apply_material(name)
+                self._merge_piece_arrays(ds)
+
+    def _compare_surface(self, key, n, ref, ds):
+        if not shares_topology(ref, ds):
+            return self._surface(ds, n, key)
+
+        def build():
+            surface, pids, cids = self._surface_ids(ref, n)
+            return share_surface(surface, pids, cids, ds), pids, cids
+        return self._store.derived(key, ("surface", n), build)[0]
+
+    def compute_difference(self):
+        """
+        選択中の配列について、比較するファイル - 1 つ目のファイル を
+        新しい配列として追加する (topology が同じ block だけ)。
+        """
+        state = self.server.state
+        arr = self._catalog.get(state.colormap_idx)
+        if not self._compare_refs or arr is None or not arr.colored:
+            return
+        name, association = arr.name, arr.association
+        diff_name = name + ' (diff)'
+        if association == vtkDataObject.FIELD_ASSOCIATION_POINTS:
+            def field(x): return x.GetPointData()
+        else:
+            def field(x): return x.GetCellData()
+
+        def add(target, values):
+            if field(target).GetArray(diff_name) is None:
+                array = numpy_support.numpy_to_vtk(values, deep=1)
+                array.SetName(diff_name)
+                field(target).AddArray(array)
+
+        lo = hi = 0.0
+        refs = set()
+        for actor, (ref_actor, _, j) in self._compare_refs.items():
+            ds = self._actor_sources[actor]
+            ref = self._actor_sources[ref_actor]
+            if not shares_topology(ref, ds):
+                continue
+            d = difference(ref, ds, name, association)
+            if d is None:
+                continue
+            _, pids, cids = self._surface_ids(ref, j)
+            ids = pids if association == \
+                vtkDataObject.FIELD_ASSOCIATION_POINTS else cids
+            if ids is not None:
+                ds_d = np.ascontiguousarray(d[ids])
+            else:
+                ds_d = d
+            # store のデータは他の session も使っているので、この session
+            # 用の copy に足す。1 つ目のファイルの方は差 0
+            ds, surface = self._own_data(actor)
+            ref, ref_surface = self._own_data(ref_actor)
+            add(ds, d)
+            add(ref, np.zeros_like(d))
+            add(surface, ds_d)
+            add(ref_surface, np.zeros_like(ds_d))
+            refs.add(ref_actor)
+            if d.size > 0:
+                lo, hi = min(lo, float(d.min())), max(hi, float(d.max()))
+        if not refs:
+            return
+
+        # filter の結果には新しい配列がないので作り直す
+        self._reset_filters()
+        idx = self._catalog.add(diff_name, association, (lo, hi),
+                                [self._block_of[a] for a in refs
+                                 if a in self._block_of])
+        self._publish_catalog()
+        if idx == state.colormap_idx:
+            self.update_colormap_idx(colormap_idx=idx)
+        state.colormap_idx = idx
+
+    def _own_data(self, actor):
+        """
+        actor の (元の dataset, 表示用データ) をこの session だけの shallow
+        copy に差し替えて返す (配列を足しても store のものは変わらない)。
+        """
+        def own(obj):
+            copy = self._session_copies.get(obj)
+            if copy is None:
+                copy = obj.NewInstance()
+                copy.ShallowCopy(obj)
+                self._session_copies[obj] = copy
+                self._session_copies[copy] = copy
+            return copy
+
+        ds = own(self._actor_sources[actor])
+        display = own(self._display_inputs[actor])
+        self._actor_sources[actor] = ds
+        self._display_inputs[actor] = display
+        if actor not in self._filters:
+            actor.GetMapper().SetInputData(display)
+        return ds, display
+
+    def _read_file(self, readercls, filename=None):
+        if filename is None:
+            filename = self._vtk_filename
+        reader = readercls()
+        # reader.DebugOn()  # 使えないらしい
+        reader.SetFileName(filename)
+        reader.Update()
+        if reader.GetErrorCode() != 0:
+            raise RuntimeError('Cannot open: ' + filename)
+
+        data_obj = reader.GetOutput()
+        if data_obj is not None:
+            data_obj.Register(reader)
+        return data_obj
+
+    def _surface(self, ds, n, key=None):
+        """描画用の surface (共有データなら store に置く)"""
+        return self._surface_ids(ds, n, key)[0]
+
+    def _surface_ids(self, ds, n, key=None):
+        """(surface, 元の点の番号, 元の cell の番号)"""
+        key = key or self._store_key
+        if key is None or vtkPolyData.SafeDownCast(ds):
+            return ds, None, None
+
+        def extract():
+            f = vtkDataSetSurfaceFilter()
+            f.SetInputData(ds)
+            f.PassThroughPointIdsOn()
+            f.PassThroughCellIdsOn()
+            f.Update()
+            surface = f.GetOutput()
+            # 番号は compare 用に numpy で持ち、surface からは外す
+            pd, cd = surface.GetPointData(), surface.GetCellData()
+            pids = numpy_support.vtk_to_numpy(
+                pd.GetArray(f.GetOriginalPointIdsName())).copy()
+            cids = numpy_support.vtk_to_numpy(
+                cd.GetArray(f.GetOriginalCellIdsName())).copy()
+            pd.RemoveArray(f.GetOriginalPointIdsName())
+            cd.RemoveArray(f.GetOriginalCellIdsName())
+            return surface, pids, cids
+        return self._store.derived(key, ("surface", n), extract)
+
+    def _view_params(self):
+        w, h = self._vtk_rw.GetSize()
+        return self.renderer.GetActiveCamera(), w / max(h, 1), h
+
+    def _add_piece_actor(self, piece, ds):
+        mapper = vtkDataSetMapper()
+        mapper.SetInputData(ds)
+        mapper.SetLookupTable(self._scalarbar_actor.GetLookupTable())
+
+        actor = vtkActor()
+        actor.SetMapper(mapper)
+        if self._draw_actors:
+            actor.GetProperty().DeepCopy(self._draw_actors[0].GetProperty())
+        self.renderer.AddActor(actor)
+        self._draw_actors.append(actor)
+        self._piece_actors[piece] = actor
+        self._display_inputs[actor] = ds
+
+        # 本物の piece が来たら preview は消す
+        if self._preview_actor is not None:
+            self.renderer.RemoveActor(self._preview_actor)
+            self._draw_actors.remove(self._preview_actor)
+            self._filters.pop(self._preview_actor, None)
+            self._actor_sources.pop(self._preview_actor, None)
+            self._display_inputs.pop(self._preview_actor, None)
+            self._preview_actor = None
+
+    def _remove_piece_actor(self, piece):
+        actor = self._piece_actors.pop(piece)
+        self.renderer.RemoveActor(actor)
+        self._draw_actors.remove(actor)
+        self._filters.pop(actor, None)
+        self._actor_sources.pop(actor, None)
+        self._display_inputs.pop(actor, None)
+
+    def _merge_piece_arrays(self, ds):
+        # range は client に送っていないので state はそのまま
+        self._catalog.merge(ds)
+
+    async def _stream_pieces(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                piece = self._loader.next_piece(self._view_params())
+                if piece is None:
+                    break
+                try:
+                    ds = await loop.run_in_executor(
+                        None, self._loader.read_piece, piece)
+                except Exception as e:
+                    # 壊れた piece は飛ばして残りを読む
+                    print(f'progressive: piece {piece}:', e, file=sys.stderr)
+                    self._loader.fail(piece)
+                    continue
+                if self.debug:
+                    print('progressive: piece', piece,
+                          'cells', ds.GetNumberOfCells())
+
+                self._loader.add(piece, ds)
+                self._add_piece_actor(piece, ds)
+                for p in self._loader.evict(self._view_params()):
+                    self._remove_piece_actor(p)
+
+                self._merge_piece_arrays(ds)
+                self._apply_colormap(self.server.state.colormap_idx)
+                self._data_bounds = self._loader.bounds
+                self._update_axes_bounds()
+                if self._filter_params():
+                    self._schedule_filters()
+                with self.server.state:
+                    self.server.controller.update_views()
+        except Exception as e:
+            print(e, file=sys.stderr)
+        finally:
+            self._loader_task = None
+
+    def _start_streaming(self):
+        if self._loader is not None and self._loader_task is None:
+            self._loader_task = asynchronous.create_task(
+                self._stream_pieces())
+
+    def on_ready(self, *a, **k):
+        super().on_ready(*a, **k)
+        self._start_streaming()
+        if self._idle_timeout > 0:
+            self.server.context.network_monitor.add_listener(
+                self._touch, self._touch)
+            asynchronous.create_task(self._watch_idle())
+
+    def _touch(self):
+        self._last_active = time.monotonic()
+        if self._suspended:
+            self.reload_data()
+            self.server.controller.update_views()
+
+    async def _watch_idle(self):
+        while True:
+            await asyncio.sleep(max(1, self._idle_timeout / 10))
+            idle = time.monotonic() - self._last_active
+            if not self._suspended and idle >= self._idle_timeout:
+                self.release_data()
+            self._store.collect()
+
+    def release_data(self):
+        """
+        renderer から actor を外して、共有データの参照を返す。
+        camera と state はそのまま残るので reload_data() で元に戻せる。
+        """
+        if self._suspended or self._loader is not None:
+            return
+        if self.debug:
+            print('release data:', self._vtk_filename)
+        for r in self._vtk_rw.GetRenderers():
+            r.RemoveAllViewProps()
+        self._draw_actors = []
+        self._actor_sources = {}
+        self._display_inputs = {}
+        self._session_copies = {}
+        self._compare_refs = {}
+        self._filters = {}
+        self._axes_actor = None
+        self._scalarbar_actor = None
+        self._volume_actor = None
+        self._volume_images = {}
+        self._bvh_actors = []
+        self._bvh_index = {}
+        self._culled = set()
+        self._pick_locators = {}
+        if self._store_key is not None:
+            self._store.release(self._store_key)
+            self._store_key = None
+        for key in self._compare_keys:
+            self._store.release(key)
+        self._compare_keys = []
+        self._suspended = True
+
+    def reload_data(self):
+        if not self._suspended:
+            return
+        if self.debug:
+            print('reload data:', self._vtk_filename)
+        self._suspended = False
+        self._catalog = ArrayCatalog()
+        renderer = self.renderer
+        for x in self.generate_actors(renderer):
+            renderer.AddActor(x)
+        if self._compare_renderers:
+            self._load_compare()
+
+        state = self.server.state
+        self._apply_colormap(state.colormap_idx)
+        self.update_lookuptable_idx(lookuptable_idx=state.lookuptable_idx)
+        self.switch_show_surface(show_surface=state.show_surface)
+        self.switch_show_axes(show_axes=state.show_axes)
+        if self._filter_params():
+            self._schedule_filters()
+        if state.volume_mode:
+            self._schedule_volume()
+
+    @change("browser_query", "browser_open")
+    def update_browser(self, *args, **kwargs):
+        state = self.server.state
+        if self._index is None or not state.browser_open:
+            return
+        total, records = self._index.query(state.browser_query or "",
+                                           limit=100)
+        state.browser_total = total
+        state.browser_items = [
+            {"path": r["path"],
+             "name": os.path.basename(r["path"]),
+             "info": r.get("error") or
+             f'{r["format"]}, {r["cells"]} cells, {len(r["arrays"])} arrays'}
+            for r in records]
+
+    def open_file(self, path):
+        if self._loader is not None or self._compare_renderers or \
+                self._open_task is not None:
+            return
+        self._open_task = asynchronous.create_task(self._open_file(path))
+
+    async def _open_file(self, path):
+        state = self.server.state
+        record = self._index.get(path) if self._index else None
+        readercls = READERCLASS.get(Path(path).suffix.lower(), None)
+        previous = self._vtk_filename
+        try:
+            self.release_data()
+            # 読み終わるまでは index の情報で配列の一覧を出しておく
+            with state:
+                state.colormap_idx = 0
+                if record is not None and "error" not in record:
+                    self._catalog = dataset_arrays(record)
+                    self._publish_catalog()
+                state.browser_loading = True
+                self.server.controller.update_views()
+
+            if readercls is None:
+                raise RuntimeError('Not found class for reading.')
+            key = self._store.file_key(path)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                None, self._store.acquire, key,
+                lambda: self._read_file(readercls, path))
+            self._vtk_filename = path
+            self.reload_data()
+            self._store.release(key)
+        except Exception as e:
+            print(e, file=sys.stderr)
+            self._vtk_filename = previous
+            self.reload_data()
+        finally:
+            self._open_task = None
+
+        with state:
+            state.browser_loading = False
+            self._publish_catalog()
+            self._apply_colormap(state.colormap_idx)
+            self.reset_camera_prop0(self.renderer)
+            self.do_icon_click(None, None)
+
+    def on_end_animation(self, camera_info, *args):
+        self._interacting = False
+        if self._volume_actor is not None:
+            # view の更新は super() でする
+            self._set_volume_input()
+        super().on_end_animation(camera_info, *args)
+        if self._loader is None:
+            return
+        for p in self._loader.evict(self._view_params()):
+            self._remove_piece_actor(p)
+        # 視野に入ってきた piece を読み直す
+        self._start_streaming()
+
+    def _filter_params(self):
+        state = self.server.state
+        params = {}
+        arr = self._catalog.get(state.colormap_idx)
+        if state.filter_threshold and arr is not None:
+            if arr.association >= 0:
+                r0, r1 = arr.range
+                lo, hi = state.filter_threshold_range
+                params["threshold"] = (arr.name, arr.association,
+                                       r0 + (r1 - r0) * lo / 100,
+                                       r0 + (r1 - r0) * hi / 100)
+
+        b = self._data_bounds
+        for name in ("clip", "slice"):
+            if b is None or not state[f"filter_{name}"]:
+                continue
+            axis = state[f"filter_{name}_axis"]
+            pos = state[f"filter_{name}_pos"] / 100
+            origin = [(b[0] + b[1]) / 2, (b[2] + b[3]) / 2,
+                      (b[4] + b[5]) / 2]
+            origin[axis] = b[axis*2] + (b[axis*2+1] - b[axis*2]) * pos
+            normal = [0.0, 0.0, 0.0]
+            normal[axis] = 1.0
+            params[name] = (tuple(origin), tuple(normal))
+        return params
+
+    @change("filter_threshold", "filter_threshold_range",
+            "filter_clip", "filter_clip_axis", "filter_clip_pos",
+            "filter_slice", "filter_slice_axis", "filter_slice_pos")
+    def update_filters(self, *args, **kwargs):
+        self._schedule_filters()
+
+    def _reset_filters(self):
+        """filter を捨てて、mapper を filter をかける前の表示に戻す"""
+        for actor in self._filters:
+            display = self._display_inputs.get(actor)
+            if display is not None:
+                actor.GetMapper().SetInputData(display)
+        self._filters = {}
+        if self._filter_params():
+            self._schedule_filters()
+
+    def _schedule_filters(self):
+        self._filter_generation += 1
+        if self._filter_task is None:
+            self._filter_task = asynchronous.create_task(self._run_filters())
+        else:
+            # 計算中のものは捨てる
+            for f in self._filters.values():
+                f.abort()
+
+    def _execute_filters(self, jobs):
+        results = []
+        for actor, f, params in jobs:
+            output = f.execute(params)
+            if output is None:
+                return None
+            results.append((actor, output))
+        return results
+
+    async def _run_filters(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                generation = self._filter_generation
+                params = self._filter_params()
+                # 選択中の配列を持っていない block は threshold しない
+                # (全部消えてしまうので、単色のまま残す)
+                unthresholded = dict(params, threshold=None)
+                idx = self.server.state.colormap_idx
+                jobs = []
+                for actor in self._draw_actors:
+                    if actor not in self._filters:
+                        # mapper の input は filter の結果のことがあるので、
+                        # 作ったときの表示用データを使う
+                        display = self._display_inputs.get(
+                            actor, actor.GetMapper().GetInput())
+                        self._filters[actor] = FilterPipeline(
+                            self._actor_sources.get(actor, display), display)
+                    block = self._block_of.get(actor, -1)
+                    skip = params.get("threshold") is not None and \
+                        not self._catalog.in_block(idx, block)
+                    jobs.append((actor, self._filters[actor],
+                                 unthresholded if skip else params))
+
+                results = await loop.run_in_executor(
+                    None, self._execute_filters, jobs)
+                if generation != self._filter_generation or results is None:
+                    continue  # 古い結果は捨ててやり直し
+
+                for actor, output in results:
+                    if actor in self._filters:
+                        actor.GetMapper().SetInputData(output)
+                with self.server.state:
+                    self.server.controller.update_views()
+                break
+        except Exception as e:
+            print(e, file=sys.stderr)
+        finally:
+            self._filter_task = None
+
+    def _volume_params(self):
+        state = self.server.state
+        arr = self._catalog.get(state.colormap_idx)
+        if not state.volume_mode or self._store_key is None or \
+                arr is None or not arr.colored:
+            return None
+        return arr.name, arr.association, state.volume_resolution
+
+    def _resampler(self):
+        # locator と resample の結果は同じファイルを見ている session で共有
+        blocks = [self._actor_sources[a] for a in self._draw_actors]
+        return self._store.derived(
+            self._store_key, "resampler",
+            lambda: VolumeResampler(blocks, self._data_bounds))
+
+    @change("volume_mode", "volume_resolution")
+    def update_volume(self, *args, **kwargs):
+        self._schedule_volume()
+
+    def _schedule_volume(self):
+        self._volume_generation += 1
+        if self._volume_task is None:
+            self._volume_task = asynchronous.create_task(self._run_volume())
+
+    async def _run_volume(self):
+        """
+        粗い volume (動かしている間に使う) を先に作って出し、
+        それから指定の解像度のものに差し替える。
+        """
+        loop = asyncio.get_running_loop()
+        state = self.server.state
+        try:
+            while True:
+                generation = self._volume_generation
+                params = self._volume_params()
+                if params is None:
+                    self._volume_images = {}
+                    break
+                name, association, resolution = params
+                resampler = self._resampler()
+                low = min(VOLUME_INFO["interactive_resolution"], resolution)
+                if resampler.cached(*params) is None:
+                    with state:
+                        state.volume_loading = True
+
+                images = {}
+                for res in (low, resolution):
+                    images[res] = await loop.run_in_executor(
+                        None, resampler.resample, name, association, res)
+                    if generation != self._volume_generation or \
+                            images[res] is None:
+                        break
+                    self._volume_images = {"low": images[low],
+                                           "full": images[res]}
+                    with state:
+                        self._show_volume()
+                if generation == self._volume_generation:
+                    if images[low] is None:
+                        self._volume_images = {}
+                    break
+                # 途中で設定が変わったらやり直し
+        finally:
+            self._volume_task = None
+            with state:
+                state.volume_loading = False
+                self._show_volume()
+
+    def _show_volume(self):
+        """volume があれば surface の actor を外して volume を出す"""
+        renderer = self.renderer
+        if not self._volume_images or self._suspended:
+            if self._volume_actor is not None:
+                renderer.RemoveVolume(self._volume_actor)
+                for actor in self._draw_actors:
+                    renderer.AddActor(actor)
+                self._volume_actor = None
+            self.server.controller.update_views()
+            return
+
+        if self._volume_actor is None:
+            # import すると OpenGL の render window が使われるようになり、
+            # GL のない環境では local render の起動でも落ちるので、ここで
+            from vtkmodules.vtkRenderingVolumeOpenGL2 import (
+                vtkSmartVolumeMapper,
+            )
+            mapper = vtkSmartVolumeMapper()
+            mapper.SetBlendModeToComposite()
+            volume = vtkVolume()
+            volume.SetMapper(mapper)
+            volume.GetProperty().SetInterpolationTypeToLinear()
+            volume.PickableOff()
+            self._volume_actor = volume
+            for actor in self._draw_actors:
+                renderer.RemoveActor(actor)
+            renderer.AddVolume(volume)
+        self._set_volume_input()
+        self._update_volume_property()
+        self.server.controller.update_views()
+
+    def _set_volume_input(self):
+        image, _ = self._volume_images[
+            "low" if self._interacting else "full"]
+        mapper = self._volume_actor.GetMapper()
+        if mapper.GetInput() is not image:
+            mapper.SetInputData(image)
+
+    def _update_volume_property(self):
+        state = self.server.state
+        arr = self._catalog.get(state.colormap_idx)
+        if self._volume_actor is None or arr is None:
+            return
+        idx = state.lookuptable_idx
+        fill = self._volume_images["full"][1]
+        # 表面の色と同じ LUT から作る (これも全 session で共有)
+        ctf, pwf = self._store.shared(
+            ("volume", idx, tuple(arr.range), fill),
+            lambda: transfer_functions(self._lookuptable(idx),
+                                       arr.range, fill))
+        prop = self._volume_actor.GetProperty()
+        prop.SetColor(ctf)
+        prop.SetScalarOpacity(pwf)
+
+    def on_start_animation(self, *a, **k):
+        super().on_start_animation(*a, **k)
+        self._interacting = True
+        if self._volume_actor is not None and \
+                self._volume_images["low"] is not \
+                self._volume_images["full"]:
+            self._set_volume_input()
+            self.server.controller.update_views()
 
     def _ui_card(self, title, ui_name):
         with vuetify.VCard(v_show=f"active_ui == '{ui_name}'"):
@@ -370,11 +1321,27 @@ class Viewer(BaseViewer):
 
     @change("show_axes")
     def switch_show_axes(self, *args, **kwargs):
+        sw = kwargs.get('show_axes', None)
+        if type(sw) is not bool:
+            return
         if self._axes_actor is not None:
-            sw = kwargs.get('show_axes', None)
-            if type(sw) is bool:
-                self._axes_actor.SetVisibility(sw)
-                self.server.controller.update_views()  # 必要！
+            self._axes_actor.SetVisibility(sw)
+        self._view.set_orientation_axis(
+            sw and self.server.state.axes_mode == "widget")
+        self.server.controller.update_views()  # 必要！
+
+    @change("axes_mode")
+    def update_axes_mode(self, *args, **kwargs):
+        mode = kwargs.get('axes_mode', None)
+        if self._suspended or self._data_bounds is None:
+            return
+        renderer = self.renderer
+        if self._axes_actor is not None:
+            renderer.RemoveActor(self._axes_actor)
+        self._axes_actor = self._create_axes(mode, renderer)
+        if self._axes_actor is not None:
+            renderer.AddActor(self._axes_actor)
+        self.switch_show_axes(show_axes=self.server.state.show_axes)
 
     @change("show_surface")
     def switch_show_surface(self, *args, **kwargs):
@@ -403,6 +1370,18 @@ class Viewer(BaseViewer):
         self.server.controller.update_views()  # 必要！
 
     def setup_ui_in_layout_toolbar(self, toolbar):
+        with vuetify.VBtn(icon=True, v_show="browser_enabled",
+                          click="browser_open = !browser_open"):
+            vuetify.VIcon("mdi-folder-search-outline")
+        vuetify.VChip(
+            "{{ pick_info }}",
+            v_show="pick_info",
+            small=True,
+            outlined=True,
+            close=True,
+            click_close="pick_info = ''",
+            classes="mx-1",
+        )
         vuetify.VSpacer()
         vuetify.VSwitch(
             label='Surface',
@@ -417,45 +1396,93 @@ class Viewer(BaseViewer):
             hide_details=True,
             dense=True,
         )
+        vuetify.VSelect(
+            v_model=('axes_mode',),
+            items=('axes_mode_list', AXES_MODES),
+            disabled=("!show_axes",),
+            hide_details=True,
+            dense=True,
+            classes="ml-2",
+            style="max-width: 140px",
+        )
         super().setup_ui_in_layout_toolbar(toolbar)
 
+    def _publish_catalog(self):
+        """配列の一覧は、絞り込んだ 1 ページ分だけ state に置く"""
+        state = self.server.state
+        items, total = self._catalog.view(state.colormap_query,
+                                          selected=state.colormap_idx)
+        state.colormap_list = items
+        state.colormap_total = total
+
+    @change("colormap_query")
+    def update_colormap_query(self, *args, **kwargs):
+        self._publish_catalog()
+
     @change("colormap_idx")
     def update_colormap_idx(self, *args, **kwargs):
         # print('update_colormap_idx', args)
         # pprint(kwargs)
         idx = kwargs.get('colormap_idx', -1)
         # print('idx', idx)
-        if len(self._dataset_arrays) == 0:
+        self._apply_colormap(idx)
+        self.server.controller.update_views()
+        if self.server.state.filter_threshold:
+            self._schedule_filters()
+        if self.server.state.volume_mode:
+            self._schedule_volume()
+
+    def _apply_colormap(self, idx):
+        arr = self._catalog.get(idx)
+        if arr is None:
             return
-        arr = self._dataset_arrays[idx]
-        type = arr.get("type")
-        uc = arr.get("u_char", False)
+        type = arr.association
+        uc = arr.u_char
 
         active_ui = "nothing"
+        sb_actor = self._scalarbar_actor
+        if sb_actor is not None:
+            # composite のときは scalar bar がない
+            sb_actor.SetVisibility(type >= 0 and not uc)
         for actor in self._draw_actors:
             mapper = actor.GetMapper()
-            if type < 0:
+            block = self._block_of.get(actor)
+            if type < 0 or (block is not None and
+                            not self._catalog.in_block(idx, block)):
+                # この配列を持っていない block は単色
                 mapper.ScalarVisibilityOff()
-                self._scalarbar_actor.SetVisibility(False)
             else:
                 mapper.ScalarVisibilityOn()
-                mapper.SelectColorArray(arr.get("variable_name"))
-                mapper.SetScalarRange(arr.get("range"))
+                mapper.SelectColorArray(arr.name)
+                mapper.SetScalarRange(arr.range)
                 if type == vtkDataObject.FIELD_ASSOCIATION_POINTS:
                     mapper.SetScalarModeToUsePointFieldData()
                 else:
                     mapper.SetScalarModeToUseCellFieldData()
-                self._scalarbar_actor.SetVisibility(not uc)
                 if not uc:
                     active_ui = "lut"
         self._server.state.active_ui = active_ui
-        self.server.controller.update_views()
 
     @change("lookuptable_idx")
     def update_lookuptable_idx(self, *args, **kwargs):
         idx = kwargs.get('lookuptable_idx', -1)
         # print('update_lookuptable_idx', idx)
 
+        lut = self._lookuptable(idx)
+        for actor in self._draw_actors:
+            mapper = actor.GetMapper()
+            mapper.SetLookupTable(lut)
+        if self._scalarbar_actor is not None:
+            self._scalarbar_actor.SetLookupTable(lut)
+        self._update_volume_property()
+        self.server.controller.update_views()
+
+    def _lookuptable(self, idx):
+        # LUT は全 session で共有
+        return self._store.shared(("lut", idx),
+                                  lambda: self._build_lookuptable(idx))
+
+    def _build_lookuptable(self, idx):
         lut = vtkLookupTable()
         # default, Rainbow (Red -> Blue)
         lut.SetHueRange(0.0, 0.66667)
@@ -500,20 +1527,54 @@ class Viewer(BaseViewer):
                 lut.SetTableValue(19, colors.GetColor4d("plum"))
 
         lut.Build()
-        for actor in self._draw_actors:
-            mapper = actor.GetMapper()
-            mapper.SetLookupTable(lut)
-        self._scalarbar_actor.SetLookupTable(lut)
-        self.server.controller.update_views()
+        return lut
+
+    def setup_ui_browser(self):
+        with vuetify.VCard(v_show="browser_open", flat=True, classes="mb-2"):
+            vuetify.VTextField(
+                v_model=("browser_query", ""),
+                label="Search files / arrays / blocks",
+                prepend_inner_icon="mdi-magnify",
+                clearable=True,
+                hide_details=True,
+                dense=True,
+                outlined=True,
+            )
+            vuetify.VProgressLinear(v_show="browser_loading",
+                                    indeterminate=True)
+            vuetify.VSubheader("{{ browser_total }} files", classes="px-0")
+            with vuetify.VList(dense=True, classes="py-0",
+                               style="max-height: 50vh; overflow-y: auto"):
+                with vuetify.VListItem(
+                        v_for="item in browser_items", key="item.path",
+                        click=(self.open_file, "[item.path]"),
+                        disabled=("browser_loading",),
+                        title=("item.path",)):
+                    with vuetify.VListItemContent():
+                        vuetify.VListItemTitle("{{ item.name }}")
+                        vuetify.VListItemSubtitle("{{ item.info }}")
+            vuetify.VDivider()
 
     def setup_ui_in_layout_drawer(self, drawer):
-        drawer.width = 175
+        drawer.width = ("browser_open ? 360 : 175",)
         with vuetify.VRow(classes="pt-2", dense=True):
             with vuetify.VCol(cols="12"):
+                self.setup_ui_browser()
+                vuetify.VTextField(
+                    v_model=("colormap_query", ""),
+                    v_show=f'colormap_total > {CATALOG_INFO["page_size"]} '
+                    '|| colormap_query',
+                    label=("`Filter ${colormap_total} arrays`",),
+                    prepend_inner_icon="mdi-magnify",
+                    clearable=True,
+                    hide_details=True,
+                    dense=True,
+                    classes="pt-1",
+                )
                 vuetify.VSelect(
                     label="Select",
                     v_model=("colormap_idx", 0),
-                    items=("colormap_list", self._dataset_arrays),
+                    items=("colormap_list",),
                     hide_details=True,
                     dense=True,
                     outlined=True,
@@ -535,6 +1596,146 @@ class Viewer(BaseViewer):
                         outlined=True,
                         classes="pt-1",
                     )
+                self.setup_ui_filters()
+                self.setup_ui_volume()
+                self.setup_ui_materials()
+                vuetify.VBtn(
+                    "Difference",
+                    v_show="compare_mode",
+                    click=self.compute_difference,
+                    block=True,
+                    small=True,
+                    classes="mt-2",
+                )
+
+    def setup_ui_materials(self):
+        with vuetify.VCard(v_show="material_list.length > 0", flat=True,
+                           classes="mt-2"):
+            with vuetify.VRow(dense=True, no_gutters=True, align="center"):
+                vuetify.VSubheader("Materials", classes="px-0")
+                vuetify.VSpacer()
+                with vuetify.VBtn(icon=True, x_small=True,
+                                  click=(self.set_materials, "[null, true]")):
+                    vuetify.VIcon("mdi-eye", small=True)
+                with vuetify.VBtn(icon=True, x_small=True,
+                                  click=(self.set_materials, "[null, false]")):
+                    vuetify.VIcon("mdi-eye-off", small=True)
+            with vuetify.VRow(v_for="m in material_list", key="m.name",
+                              dense=True, no_gutters=True):
+                with vuetify.VCol(cols="12"):
+                    vuetify.VCheckbox(
+                        input_value=("m.visible",),
+                        label=("`${m.name} (${m.blocks})`",),
+                        change=(self.set_materials, "[[m.name], $event]"),
+                        hide_details=True,
+                        dense=True,
+                        classes="mt-0",
+                    )
+                    vuetify.VSlider(
+                        value=("m.opacity",),
+                        min=0, max=1, step=0.05,
+                        disabled=("!m.visible",),
+                        change=(self.set_materials,
+                                "[[m.name], null, $event]"),
+                        hide_details=True,
+                        dense=True,
+                    )
+
+    def setup_ui_volume(self):
+        vuetify.VSwitch(
+            label='Volume',
+            v_model=('volume_mode', False),
+            v_show="volume_enabled",
+            hide_details=True,
+            dense=True,
+        )
+        vuetify.VSelect(
+            label="Resolution",
+            v_model=("volume_resolution",),
+            items=("volume_resolution_list",
+                   sorted({*VOLUME_INFO["resolutions"],
+                           self.server.state.volume_resolution})),
+            v_show="volume_enabled",
+            disabled=("!volume_mode",),
+            hide_details=True,
+            dense=True,
+            outlined=True,
+            classes="pt-1",
+        )
+        vuetify.VProgressLinear(v_show="volume_loading", indeterminate=True)
+
+    def setup_ui_filters(self):
+        vuetify.VSwitch(
+            label='Threshold',
+            v_model=('filter_threshold', False),
+            hide_details=True,
+            dense=True,
+        )
+        vuetify.VRangeSlider(
+            v_model=("filter_threshold_range", [0, 100]),
+            min=0, max=100, step=1,
+            disabled=("!filter_threshold",),
+            hide_details=True,
+            dense=True,
+        )
+        _axes = [
+            {"text": "X", "value": 0},
+            {"text": "Y", "value": 1},
+            {"text": "Z", "value": 2},
+        ]
+        for name, label in (("clip", "Clip"), ("slice", "Slice")):
+            vuetify.VSwitch(
+                label=label,
+                v_model=(f'filter_{name}', False),
+                hide_details=True,
+                dense=True,
+            )
+            vuetify.VSelect(
+                label="Normal",
+                v_model=(f"filter_{name}_axis",),
+                items=("filter_axis_list", _axes),
+                disabled=(f"!filter_{name}",),
+                hide_details=True,
+                dense=True,
+                outlined=True,
+                classes="pt-1",
+            )
+            vuetify.VSlider(
+                v_model=(f"filter_{name}_pos",),
+                min=0, max=100, step=1,
+                disabled=(f"!filter_{name}",),
+                hide_details=True,
+                dense=True,
+            )
+
+
+def setup_compression(level, viewer):
+    """websocket の deflate を使うか決めて trame の引数に足す"""
+    buffers = geometry_buffers(viewer.renderer) if level < 0 else []
+    if viewer.debug and buffers:
+        print('deflate:', measure_deflate(buffers))
+    if not use_deflate(level, buffers):
+        sys.argv.append('--no-ws-compress')
+
+
+def start_sessions(n, compression_level=-1, **kwargs):
+    """
+    1 プロセスで n 個の session を動かす (port は --port から連番)。
+    読み込んだデータは STORE で共有される。
+    """
+    STORE.idle_timeout = kwargs.get('idle_timeout', 0)
+    viewers = [Viewer(server_or_name=f"session{i}", **kwargs)
+               for i in range(n)]
+    port = viewers[0].server.cli.parse_known_args()[0].port
+    setup_compression(compression_level, viewers[0])
+
+    async def serve():
+        await asyncio.gather(*[
+            v.server.start(port=port + i, exec_mode="coroutine",
+                           open_browser=False)
+            for i, v in enumerate(viewers)
+        ])
+    asyncio.run(serve())
 
 
 def main():
@@ -556,6 +1757,61 @@ def main():
         "--debug", action='store_true',
         help="log debugging messages to stdout",
     )
+    parser.add_argument(
+        "--progressive", action='store_true',
+        help="load XML files piece by piece (out-of-core)",
+    )
+    parser.add_argument(
+        "--pieces", type=int, default=8,
+        help="number of pieces for --progressive (default: 8)",
+    )
+    parser.add_argument(
+        "--memory-limit", type=int, default=1024,
+        help="memory limit in MB for --progressive (default: 1024)",
+    )
+    parser.add_argument(
+        "--sessions", type=int, default=1,
+        help="number of sessions sharing loaded data (port, port+1, ...)",
+    )
+    parser.add_argument(
+        "--idle-timeout", type=int, default=0,
+        help="release data of sessions idle for this many seconds "
+        "(default: 0, never)",
+    )
+    parser.add_argument(
+        "--axes", default="cube",
+        choices=[m["value"] for m in AXES_MODES],
+        help="axes mode (default: cube)",
+    )
+    parser.add_argument(
+        "--compare", action='store_true',
+        help="show all files side by side with a linked camera",
+    )
+    parser.add_argument(
+        "--index", default=None,
+        help="file index made by trame_sample_apps.indexer "
+        "(shows the file browser)",
+    )
+    parser.add_argument(
+        "--volume-resolution", type=int, default=VOLUME_INFO["resolution"],
+        help="points along the longest side in volume mode "
+        f'(default: {VOLUME_INFO["resolution"]})',
+    )
+    parser.add_argument(
+        "--cull", action='store_true',
+        help="do not draw blocks out of view or smaller than --cull-pixels "
+        "(updated when the camera stops)",
+    )
+    parser.add_argument(
+        "--cull-pixels", type=float, default=BVH_INFO["min_pixels"],
+        help="minimum block size on screen in pixels for --cull "
+        f'(default: {BVH_INFO["min_pixels"]})',
+    )
+    parser.add_argument(
+        "--compression-level", type=int, default=-1,
+        help="websocket compression: 0 off, 1-9 on, -1 on only if deflate "
+        "makes the loaded geometry arrive faster (default: -1)",
+    )
     parser.add_argument(
         "filename", nargs='*',
         help="VTK file name",
@@ -586,8 +1842,16 @@ def main():
 
     try:
         sys.argv = argv_trame
-        viewer = Viewer(**vars(opts))
-        viewer.server.start()
+        kwargs = vars(opts)
+        sessions = kwargs.pop('sessions')
+        STORE.idle_timeout = opts.idle_timeout
+        if sessions > 1:
+            start_sessions(sessions, **kwargs)
+        else:
+            compression_level = kwargs.pop('compression_level')
+            viewer = Viewer(**kwargs)
+            setup_compression(compression_level, viewer)
+            viewer.server.start()
     except Exception as e:
         print(e, file=sys.stderr)
 
@@ -0,0 +1,56 @@
+#
+import sys
+import time
+import argparse
+
+from ._index import FileIndex
+from .app2 import READERCLASS
+
+assert sys.version_info[:2] >= (3, 10), "Python 3.10 required"  # noqa
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Index VTK files for the app2 file browser",
+    )
+    parser.add_argument(
+        "--index", default="trame_index.sqlite",
+        help="index file, SQLite or *.json (default: trame_index.sqlite)",
+    )
+    parser.add_argument(
+        "--list", action='store_true',
+        help="print the indexed files",
+    )
+    parser.add_argument(
+        "--debug", action='store_true',
+        help="log debugging messages to stdout",
+    )
+    parser.add_argument(
+        "directory", nargs='*',
+        help="directories to scan",
+    )
+    opts = parser.parse_args()
+
+    index = FileIndex(opts.index)
+    try:
+        if opts.directory:
+            t = time.perf_counter()
+            added, updated, removed, unchanged = index.refresh(
+                opts.directory, READERCLASS, debug=opts.debug)
+            print(f'{added} added, {updated} updated, {removed} removed, '
+                  f'{unchanged} unchanged '
+                  f'({time.perf_counter() - t:.1f} s)')
+        if opts.list:
+            total, records = index.query(limit=None)
+            for r in records:
+                if "error" in r:
+                    print(r["path"], 'ERROR:', r["error"])
+                    continue
+                print(r["path"], r["format"], r["points"], r["cells"],
+                      " ".join(a["name"] for a in r["arrays"]))
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+#
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+from pprint import pprint  # noqa
+
+import aiohttp
+from aiohttp import web
+
+assert sys.version_info[:2] >= (3, 10), "Python 3.10 required"  # noqa
+
+WORKER_COOKIE = "trame_sample_worker"
+HOP_HEADERS = {
+    "connection", "keep-alive", "transfer-encoding", "upgrade",
+    "content-length", "host",
+}
+
+
+def free_port(host):
+    with socket.socket() as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+def app2_command(args, host, port):
+    # "--" の後ろは trame の引数
+    args = list(args)
+    if "--" not in args:
+        args.append("--")
+    return [sys.executable, "-m", "trame_sample_apps.app2", *args,
+            "--server", "--host", host, "--port", str(port)]
+
+
+def proc_stats(pid):
+    """
+    /proc から (cpu 時間 [s], rss [byte]) を読む (Linux 用)
+    """
+    page = os.sysconf("SC_PAGE_SIZE")
+    tick = os.sysconf("SC_CLK_TCK")
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm") as f:
+            rss = int(f.read().split()[1]) * page
+    except OSError:
+        return 0.0, 0
+    # utime, stime は ")" の後ろの 12, 13 番目
+    return (int(stat[11]) + int(stat[12])) / tick, rss
+
+
+class PoolFull(Exception):
+    """max_workers の worker が全部使われている"""
+
+
+class Worker:
+    def __init__(self, wid, host, port, args, debug=False):
+        self.wid = wid
+        self.host = host
+        self.port = port
+        self.sessions = 0
+        self.served = 0
+        self.reserved = []  # 接続待ちの割り当て時刻
+        self.cpu = 0.0  # 使用率 (1.0 = 1 core)
+        self.rss = 0
+        self.started = time.monotonic()
+        self.last_active = self.started
+        self._cpu_time = 0.0
+        self._cpu_stamp = self.started
+
+        cmd = app2_command(args, host, port)
+        if debug:
+            print("worker", wid, "start:", " ".join(cmd))
+        self.process = subprocess.Popen(
+            cmd,
+            stdout=None if debug else subprocess.DEVNULL,
+            stderr=None if debug else subprocess.DEVNULL,
+        )
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    @property
+    def load(self):
+        self.reserved = [t for t in self.reserved
+                         if time.monotonic() - t < 30]
+        return self.sessions + len(self.reserved), self.cpu, self.rss
+
+    async def wait_ready(self, timeout=120):
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            if not self.alive:
+                break
+            try:
+                _, w = await asyncio.open_connection(self.host, self.port)
+                w.close()
+                return True
+            except OSError:
+                await asyncio.sleep(0.5)
+        return False
+
+    def update_stats(self):
+        now = time.monotonic()
+        cpu_time, self.rss = proc_stats(self.process.pid)
+        if now > self._cpu_stamp:
+            self.cpu = (cpu_time - self._cpu_time) / (now - self._cpu_stamp)
+        self._cpu_time, self._cpu_stamp = cpu_time, now
+
+    def stop(self):
+        if self.alive:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    def metrics(self):
+        sessions, cpu, rss = self.load
+        return {
+            "id": self.wid,
+            "pid": self.process.pid,
+            "port": self.port,
+            "alive": self.alive,
+            "sessions": self.sessions,
+            "pending": sessions - self.sessions,
+            "served": self.served,
+            "cpu": round(cpu, 3),
+            "rss_mb": round(rss / 2**20, 1),
+            "idle": round(time.monotonic() - self.last_active, 1)
+            if self.sessions == 0 else 0,
+            "uptime": round(time.monotonic() - self.started, 1),
+        }
+
+
+class WorkerPool:
+    """
+    app2 のプロセスを複数立ち上げて、新しい session を一番空いている
+    worker に割り当てる。
+    - 空いている worker がなければ max_workers まで増やす
+      (それでも足りなければ断る。worker を 2 人で使うと state が共有される)
+    - idle_timeout 秒使われていない worker は min_workers まで減らす
+    - max_rss を超えた worker は、使われなくなったら作り直す
+    """
+
+    def __init__(self, args, host="127.0.0.1", min_workers=1,
+                 max_workers=None, idle_timeout=300, max_rss=0,
+                 debug=False):
+        self._args = args
+        self._host = host
+        self._min_workers = max(1, min_workers)
+        self._max_workers = max(self._min_workers,
+                                max_workers or os.cpu_count() or 1)
+        self._idle_timeout = idle_timeout
+        self._max_rss = max_rss * 2**20
+        self._debug = debug
+        self._workers = {}
+        self._next_id = 0
+        self._lock = asyncio.Lock()
+
+    @property
+    def workers(self):
+        return list(self._workers.values())
+
+    def get(self, wid):
+        w = self._workers.get(wid)
+        return w if w is not None and w.alive else None
+
+    def _launch(self):
+        """worker のプロセスを起動して登録する (起動を待つのは _ready)"""
+        self._next_id += 1
+        w = Worker(str(self._next_id), self._host, free_port(self._host),
+                   self._args, debug=self._debug)
+        self._workers[w.wid] = w
+        return w
+
+    async def _ready(self, w):
+        if not await w.wait_ready():
+            self._workers.pop(w.wid, None)
+            await self._stop(w)
+            raise RuntimeError('worker did not start: ' + " ".join(
+                self._args))
+        return w
+
+    async def _stop(self, w):
+        # process.wait() で event loop を止めないように
+        await asyncio.get_running_loop().run_in_executor(None, w.stop)
+
+    async def spawn(self):
+        async with self._lock:
+            w = self._launch()
+        return await self._ready(w)
+
+    async def start(self):
+        await asyncio.gather(*[self.spawn()
+                               for _ in range(self._min_workers)])
+
+    async def assign(self):
+        """
+        新しい session の割り当て先。trame の server は state を 1 つしか
+        持たないので、worker を共有させずに、全部使われていれば PoolFull。
+        """
+        async with self._lock:
+            for w in self.workers:
+                w.update_stats()
+            alive = [w for w in self.workers if w.alive]
+            free = [w for w in alive if w.load[0] == 0]
+            if free:
+                w = min(free, key=lambda x: x.load)
+            elif len(alive) < self._max_workers:
+                w = self._launch()
+            else:
+                raise PoolFull(len(alive))
+            w.reserved.append(time.monotonic())
+        # 起動を待つ間も他の接続は lock を待たない
+        return await self._ready(w)
+
+    def connected(self, w):
+        if w.reserved:
+            w.reserved.pop(0)
+        w.sessions += 1
+        w.served += 1
+        w.last_active = time.monotonic()
+
+    def disconnected(self, w):
+        w.sessions = max(0, w.sessions - 1)
+        w.last_active = time.monotonic()
+
+    async def recycle(self):
+        stopped, launched = [], []
+        async with self._lock:
+            now = time.monotonic()
+            for w in self.workers:
+                w.update_stats()
+                idle = w.load[0] == 0 and \
+                    now - w.last_active >= self._idle_timeout
+                if not w.alive:
+                    del self._workers[w.wid]
+                elif idle and len(self._workers) > self._min_workers:
+                    if self._debug:
+                        print("worker", w.wid, "stop (idle)")
+                    stopped.append(self._workers.pop(w.wid))
+                elif w.load[0] == 0 and 0 < self._max_rss < w.rss:
+                    if self._debug:
+                        print("worker", w.wid, "restart (rss)")
+                    stopped.append(self._workers.pop(w.wid))
+            while len(self._workers) < self._min_workers:
+                launched.append(self._launch())
+        await asyncio.gather(*[self._stop(w) for w in stopped])
+        await asyncio.gather(*[self._ready(w) for w in launched])
+
+    async def run_recycler(self, interval=5):
+        while True:
+            await asyncio.sleep(interval)
+            await self.recycle()
+
+    def stop(self):
+        for w in self.workers:
+            w.stop()
+
+    def metrics(self):
+        workers = [w.metrics() for w in self.workers]
+        return {
+            "workers": workers,
+            "sessions": sum(w["sessions"] for w in workers),
+            "cpu": round(sum(w["cpu"] for w in workers), 3),
+            "rss_mb": round(sum(w["rss_mb"] for w in workers), 1),
+            "min_workers": self._min_workers,
+            "max_workers": self._max_workers,
+        }
+
+
+async def _proxy_ws(request, pool, w):
+    ws = web.WebSocketResponse(max_msg_size=0)
+    await ws.prepare(request)
+    pool.connected(w)
+    session = request.app["client"]
+    try:
+        async with session.ws_connect(w.url + request.path_qs,
+                                      max_msg_size=0) as upstream:
+            async def forward(src, dst):
+                async for msg in src:
+                    if msg.type == aiohttp.WSMsgType.TEXT:
+                        await dst.send_str(msg.data)
+                    elif msg.type == aiohttp.WSMsgType.BINARY:
+                        await dst.send_bytes(msg.data)
+                    else:
+                        break
+                await dst.close()
+            await asyncio.gather(forward(ws, upstream),
+                                 forward(upstream, ws))
+    finally:
+        pool.disconnected(w)
+    return ws
+
+
+async def _proxy_http(request, w):
+    session = request.app["client"]
+    headers = {k: v for k, v in request.headers.items()
+               if k.lower() not in HOP_HEADERS}
+    async with session.request(request.method, w.url + request.path_qs,
+                               headers=headers,
+                               data=await request.read(),
+                               allow_redirects=False) as r:
+        body = await r.read()
+        headers = {k: v for k, v in r.headers.items()
+                   if k.lower() not in HOP_HEADERS}
+        return web.Response(status=r.status, body=body, headers=headers)
+
+
+async def handle(request):
+    pool = request.app["pool"]
+    w = pool.get(request.cookies.get(WORKER_COOKIE))
+    new = w is None or "new" in request.query
+    if new and request.path in ("/", "/index.html"):
+        try:
+            w = await pool.assign()
+        except PoolFull as e:
+            raise web.HTTPServiceUnavailable(
+                headers={"Retry-After": "30"},
+                text=f"all {e.args[0]} workers are in use, "
+                "try again later")
+    if w is None:
+        raise web.HTTPServiceUnavailable(text="no session, open / first")
+
+    if request.headers.get("Upgrade", "").lower() == "websocket":
+        return await _proxy_ws(request, pool, w)
+    response = await _proxy_http(request, w)
+    if new:
+        response.set_cookie(WORKER_COOKIE, w.wid)
+    return response
+
+
+async def handle_metrics(request):
+    return web.json_response(request.app["pool"].metrics())
+
+
+def create_app(pool):
+    app = web.Application()
+    app["pool"] = pool
+
+    async def startup(app):
+        app["client"] = aiohttp.ClientSession(
+            auto_decompress=False,
+            timeout=aiohttp.ClientTimeout(total=None))
+        await pool.start()
+        app["recycler"] = asyncio.create_task(pool.run_recycler())
+
+    async def cleanup(app):
+        app["recycler"].cancel()
+        await app["client"].close()
+        pool.stop()
+
+    app.on_startup.append(startup)
+    app.on_cleanup.append(cleanup)
+    app.router.add_get("/_pool/metrics", handle_metrics)
+    app.router.add_route("*", "/{path:.*}", handle)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Session pool launcher for app2",
+    )
+    parser.add_argument(
+        "--host", default="localhost",
+        help="interface to listen on (default: localhost)",
+    )
+    parser.add_argument(
+        "-p", "--port", type=int, default=8080,
+        help="port to listen on (default: 8080)",
+    )
+    parser.add_argument(
+        "--min-workers", type=int, default=1,
+        help="number of worker processes kept running (default: 1)",
+    )
+    parser.add_argument(
+        "--max-workers", type=int, default=os.cpu_count(),
+        help="max number of worker processes (default: number of cores)",
+    )
+    parser.add_argument(
+        "--idle-timeout", type=int, default=300,
+        help="stop workers idle for this many seconds (default: 300)",
+    )
+    parser.add_argument(
+        "--max-rss", type=int, default=0,
+        help="restart idle workers using more than this many MB "
+        "(default: 0, never)",
+    )
+    parser.add_argument(
+        "--debug", action='store_true',
+        help="log debugging messages to stdout",
+    )
+
+    argv = sys.argv
+    app_args = []
+    if '--' in sys.argv:
+        n = sys.argv.index('--')
+        argv = sys.argv[:n]
+        app_args = sys.argv[n+1:]
+    opts = parser.parse_args(argv[1:])
+    if opts.debug:
+        print('args:', vars(opts))
+        print('app2 args:', app_args)
+
+    pool = WorkerPool(app_args, min_workers=opts.min_workers,
+                      max_workers=opts.max_workers,
+                      idle_timeout=opts.idle_timeout,
+                      max_rss=opts.max_rss, debug=opts.debug)
+    try:
+        web.run_app(create_app(pool), host=opts.host, port=opts.port)
+    finally:
+        pool.stop()
+
+
+if __name__ == "__main__":
+    main()
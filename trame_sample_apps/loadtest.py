@@ -0,0 +1,317 @@
+#
+import re
+import sys
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+
+import aiohttp
+import msgpack
+from wslink.chunking import generate_chunks, UnChunker
+
+from .launcher import app2_command, free_port, proc_stats
+
+assert sys.version_info[:2] >= (3, 10), "Python 3.10 required"  # noqa
+
+SECRET = "wslink-secret"
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    f = int(k)
+    c = min(f + 1, len(values) - 1)
+    return values[f] + (values[c] - values[f]) * (k - f)
+
+
+class Client:
+    """
+    wslink で trame server につなぐ、ブラウザの代わりのクライアント
+    """
+
+    def __init__(self, url, session, timeout=60):
+        self._url = url
+        self._session = session
+        self._timeout = timeout
+        self._ws = None
+        self._count = 0
+        self._max_size = 0
+        self._pending = {}
+        self._reader = None
+        self.bytes_received = 0
+        self.client_id = "c0"
+
+    async def connect(self):
+        self._ws = await self._session.ws_connect(self._url, max_msg_size=0)
+        self._reader = asyncio.create_task(self._read())
+        result = await self.call("wslink.hello", {"secret": SECRET},
+                                 rpcid="system:c0:0")
+        self.client_id = result["clientID"]
+        self._max_size = result.get("maxMsgSize", 0)
+
+    async def close(self):
+        if self._ws is not None:
+            await self._ws.close()
+        if self._reader is not None:
+            self._reader.cancel()
+
+    async def _read(self):
+        unchunker = UnChunker()
+        unchunker.set_max_message_size(2**32)
+        try:
+            async for msg in self._ws:
+                if msg.type != aiohttp.WSMsgType.BINARY:
+                    break
+                self.bytes_received += len(msg.data)
+                # 全部そろったら msgpack を展開したものが返ってくる
+                rpc = unchunker.process_chunk(msg.data)
+                if rpc is None:
+                    continue
+                future = self._pending.pop(rpc.get("id"), None)
+                if future is not None and not future.done():
+                    if "error" in rpc:
+                        future.set_exception(RuntimeError(str(rpc["error"])))
+                    else:
+                        future.set_result(rpc.get("result"))
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("closed"))
+
+    async def call(self, method, *args, rpcid=None):
+        self._count += 1
+        if rpcid is None:
+            rpcid = f"rpc:{self.client_id}:{self._count}"
+        future = asyncio.get_running_loop().create_future()
+        self._pending[rpcid] = future
+        payload = msgpack.packb({
+            "wslink": "1.0",
+            "id": rpcid,
+            "method": method,
+            "args": list(args),
+            "kwargs": {},
+        })
+        for chunk in generate_chunks(payload, self._max_size):
+            await self._ws.send_bytes(chunk)
+        return await asyncio.wait_for(future, self._timeout)
+
+
+def camera_event(rng, scale):
+    """on_end_animation() に渡るのと同じ形の camera 情報"""
+    theta = rng.uniform(0, 360)
+    return {
+        "position": [10 * rng.uniform(-1, 1), 10 * rng.uniform(-1, 1),
+                     10 * rng.uniform(-1, 1)],
+        "focalPoint": [0.0, 0.0, 0.0],
+        "viewUp": [0.0, 1.0, 0.0] if theta < 180 else [0.0, 0.0, 1.0],
+        "viewAngle": 30.0,
+        "parallelProjection": True,
+        "parallelScale": scale,
+    }
+
+
+class Scenario:
+    """
+    接続 -> EndAnimation / colormap_idx / lookuptable_idx / scale を繰り返す
+    """
+
+    def __init__(self, url, think_time=0.2, seed=None):
+        self._url = url
+        self._think_time = think_time
+        self._rng = random.Random(seed)
+        self.latencies = {}
+        self.errors = 0
+        self.bytes_received = 0
+
+    def _record(self, name, dt):
+        self.latencies.setdefault(name, []).append(dt)
+
+    async def run(self, session, stop_at):
+        rng = self._rng
+        client = Client(self._url, session)
+        t0 = time.perf_counter()
+        try:
+            await client.connect()
+            server_state = await client.call("trame.state.get")
+            self._record("connect", time.perf_counter() - t0)
+        except Exception:
+            self.errors += 1
+            await client.close()
+            return
+
+        state = server_state.get("state", {})
+        template = " ".join(str(v) for k, v in state.items()
+                            if k.startswith("trame__template"))
+        m = re.search(r"@EndAnimation=\"trigger\('(\w+)'", template)
+        trigger = m.group(1) if m else None
+        arrays = len(state.get("colormap_list", [])) or 1
+        scale0 = 1.0
+
+        actions = ["colormap_idx", "lookuptable_idx", "scale"]
+        if trigger is not None:
+            actions += ["EndAnimation"] * 3
+
+        while time.perf_counter() < stop_at:
+            action = rng.choice(actions)
+            t = time.perf_counter()
+            try:
+                match action:
+                    case "EndAnimation":
+                        await client.call(
+                            "trame.trigger", trigger,
+                            [camera_event(rng, scale0 / rng.uniform(0.5, 2))],
+                            {})
+                    case "colormap_idx":
+                        await client.call("trame.state.update", [
+                            {"key": action, "value": rng.randrange(arrays)}])
+                    case "lookuptable_idx":
+                        await client.call("trame.state.update", [
+                            {"key": action, "value": rng.randrange(4)}])
+                    case "scale":
+                        await client.call("trame.state.update", [
+                            {"key": action,
+                             "value": round(rng.uniform(0.1, 3.0), 1)}])
+                self._record(action, time.perf_counter() - t)
+            except Exception:
+                self.errors += 1
+                break
+            await asyncio.sleep(rng.uniform(0, 2 * self._think_time))
+        self.bytes_received += client.bytes_received
+        await client.close()
+
+
+async def run_step(url, clients, duration, think_time, pid=None):
+    scenarios = [Scenario(url, think_time, seed=i) for i in range(clients)]
+    rss = []
+
+    async def sample():
+        while True:
+            rss.append(proc_stats(pid)[1])
+            await asyncio.sleep(0.5)
+
+    sampler = asyncio.create_task(sample()) if pid else None
+    t0 = time.perf_counter()
+    stop_at = t0 + duration
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*[s.run(session, stop_at) for s in scenarios])
+    elapsed = time.perf_counter() - t0
+    if sampler is not None:
+        sampler.cancel()
+
+    latencies = {}
+    for s in scenarios:
+        for k, v in s.latencies.items():
+            latencies.setdefault(k, []).extend(v)
+    updates = [x for k, v in latencies.items() if k != "connect" for x in v]
+    return {
+        "clients": clients,
+        "requests": len(updates),
+        "errors": sum(s.errors for s in scenarios),
+        "throughput": len(updates) / elapsed,
+        "p50": percentile(updates, 50) * 1000,
+        "p95": percentile(updates, 95) * 1000,
+        "p99": percentile(updates, 99) * 1000,
+        "connect_p50": percentile(latencies.get("connect", []), 50) * 1000,
+        "mb_received": sum(s.bytes_received for s in scenarios) / 2**20,
+        "rss_mb": max(rss) / 2**20 if rss else 0.0,
+        "per_action": {k: percentile(v, 50) * 1000
+                       for k, v in latencies.items()},
+    }
+
+
+def print_report(results, verbose=False):
+    print(f"{'clients':>7} {'req':>7} {'err':>4} {'req/s':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'conn ms':>8} {'MB recv':>8} {'RSS MB':>8}")
+    for r in results:
+        print(f"{r['clients']:>7} {r['requests']:>7} {r['errors']:>4} "
+              f"{r['throughput']:>8.1f} {r['p50']:>8.1f} {r['p95']:>8.1f} "
+              f"{r['p99']:>8.1f} {r['connect_p50']:>8.1f} "
+              f"{r['mb_received']:>8.1f} {r['rss_mb']:>8.1f}")
+        if verbose:
+            for k, v in sorted(r["per_action"].items()):
+                print(f"{'':>7} {k}: p50 {v:.1f} ms")
+
+
+async def wait_port(host, port, timeout=120):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            _, w = await asyncio.open_connection(host, port)
+            w.close()
+            return True
+        except OSError:
+            await asyncio.sleep(0.5)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test for trame_sample_apps servers",
+    )
+    parser.add_argument(
+        "--url", default=None,
+        help="websocket url of a running server (e.g. ws://localhost:8080/ws)",
+    )
+    parser.add_argument(
+        "--pid", type=int, default=None,
+        help="pid of the running server (to report its RSS)",
+    )
+    parser.add_argument(
+        "--clients", default="1,2,4,8,16",
+        help="comma separated numbers of clients (default: 1,2,4,8,16)",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=20,
+        help="seconds per step (default: 20)",
+    )
+    parser.add_argument(
+        "--think-time", type=float, default=0.2,
+        help="mean seconds between actions of a client (default: 0.2)",
+    )
+    parser.add_argument(
+        "--verbose", action='store_true',
+        help="show latency per action",
+    )
+
+    argv = sys.argv
+    app_args = None
+    if '--' in sys.argv:
+        n = sys.argv.index('--')
+        argv = sys.argv[:n]
+        app_args = sys.argv[n+1:]
+    opts = parser.parse_args(argv[1:])
+
+    server = None
+    url, pid = opts.url, opts.pid
+    if app_args is not None:
+        # "--" の後ろの引数で app2 を起動する
+        port = free_port("127.0.0.1")
+        server = subprocess.Popen(
+            app2_command(app_args, "127.0.0.1", port),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        url, pid = f"ws://127.0.0.1:{port}/ws", server.pid
+        if not asyncio.run(wait_port("127.0.0.1", port)):
+            server.terminate()
+            print('server did not start', file=sys.stderr)
+            return
+    elif url is None:
+        parser.error("--url or -- APP2-ARGS is required")
+
+    try:
+        results = []
+        for n in [int(x) for x in opts.clients.split(",")]:
+            results.append(asyncio.run(run_step(
+                url, n, opts.duration, opts.think_time, pid)))
+        print_report(results, opts.verbose)
+    finally:
+        if server is not None:
+            server.terminate()
+
+
+if __name__ == "__main__":
+    main()